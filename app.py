@@ -1,169 +1,45 @@
 import datetime
+import json
 import os
-import re
-import sqlite3
-import subprocess
 import threading
+import time
 import uuid
-import zipfile
-from concurrent.futures import ThreadPoolExecutor
-
-import yt_dlp
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, jsonify, render_template, request, send_file, session
-from yt_dlp.utils import sanitize_filename
-
-from config import AUDIO_FORMATS, RESOLUTIONS, SESSION_LIFETIME, VIDEO_FORMATS
-from flask_session import Session
-from init_db import DB_PATH
-from utils import cleanup_expired_sessions, get_safe_thread_count
+
+from flask import Flask, Response, jsonify, render_template, request, session
+
+from config import (AUDIO_FORMATS, RESOLUTIONS, SESSION_LIFETIME, SSE_KEEPALIVE_INTERVAL, SSE_MAX_STREAMS,
+                    SSE_POLL_INTERVAL, SSE_RETRY_MS, SSE_STREAM_DURATION, TRACE_STATS_WINDOW, VIDEO_FORMATS)
+from db import close_connection, execute, query_all, query_one
+from delivery import send_download, stream_zip
+from inflight import join_or_lead
+from init_db import init_db
+from jobs import enqueue_job, estimate_job_cost, get_queue_positions
+from metadata_cache import get_cache_stats, peek_cached_info
+from metrics import render
+from output_cache import fetch_cached_output, get_output_key
+from progress import PROGRESS_FIELDS, update_status
+from storage import admit, estimate_output_size, get_storage_usage
+from tracing import get_job_trace, get_stage_stats
+from utils import get_safe_thread_count, get_secret_key, touch_session
 from validations import *
+from zipstream import has_zip_manifest
+
+# Runs once in the Gunicorn master with preload_app (gunicorn.conf.py), before the workers fork,
+# which must not inherit its SQLite connection
+init_db()
+close_connection()
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['PERMANENT_SESSION_LIFETIME'] = SESSION_LIFETIME 
-
-Session(app)
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=cleanup_expired_sessions, trigger="interval", seconds=10)
-scheduler.start()
-
-# Threading setup
-NUM_OF_THREADS = get_safe_thread_count()
-executor = ThreadPoolExecutor(max_workers=NUM_OF_THREADS)
-db_lock = threading.Lock()
-
-def get_timestamp():
-    """Generate a timestamp for file naming."""
-    return datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-
-def update_status(download_id, status, file_path=None):
-    """Update the download status in the database."""
-    with db_lock:
-        with sqlite3.connect(DB_PATH) as conn:
-            if file_path:
-                conn.execute(
-                    'UPDATE downloads SET status = ?, file_path = ? WHERE download_id = ?',
-                    (status, file_path, download_id)
-                )
-            else:
-                conn.execute(
-                    'UPDATE downloads SET status = ? WHERE download_id = ?',
-                    (status, download_id)
-                )
-            conn.commit()
-
-def check_video_duration(url, resolution, is_playlist=False):
-    """
-    Check if video(s) duration exceeds limits for 4K (15 min) or 2K (30 min).
-    Returns a tuple: (is_valid, error_message).
-    """
-    limits = {'4k': 15 * 60, '2k': 30 * 60}  # in seconds
-    if resolution not in limits:
-        return True, None
-
-    try:
-        ydl_opts = {'extract_flat': is_playlist, 'quiet': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if is_playlist:
-                if not info or 'entries' not in info:
-                    return False, "Could not retrieve playlist information"
-                for entry in info['entries']:
-                    if entry:
-                        duration = entry.get('duration', 0)
-                        if duration > limits[resolution]:
-                            return False, f"Video '{entry.get('title', 'Unknown')}' exceeds {limits[resolution]//60}-minute limit for {resolution}"
-            else:
-                duration = info.get('duration', 0)
-                if duration > limits[resolution]:
-                    return False, f"Video exceeds {limits[resolution]//60}-minute limit for {resolution}"
-        return True, None
-    except Exception as e:
-        return False, f"Error checking duration: {str(e)}"
-
-# Threading setup
-NUM_OF_THREADS = 4
-executor = ThreadPoolExecutor(max_workers=NUM_OF_THREADS)
-db_lock = threading.Lock()
-
-def is_playlist(url):
-    return 'playlist' in url.lower() or 'list=' in url
-
-def get_timestamp():
-    return datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-
-def update_status(download_id, status, file_path=None):
-    with db_lock:
-        with sqlite3.connect(DB_PATH) as conn:
-            if file_path:
-                conn.execute(
-                    'UPDATE downloads SET status = ?, file_path = ? WHERE download_id = ?',
-                    (status, file_path, download_id)
-                )
-            else:
-                conn.execute(
-                    'UPDATE downloads SET status = ? WHERE download_id = ?',
-                    (status, download_id)
-                )
-            conn.commit()
-
-def cleanup_expired_sessions():
-    expiration = datetime.datetime.now() - datetime.timedelta(seconds=30)
-    with db_lock:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.execute(
-                'SELECT session_id, file_path FROM downloads WHERE created_at < ?',
-                (expiration,)
-            )
-            sessions_to_delete = set()
-            for row in cursor.fetchall():
-                session_id, file_path = row
-                sessions_to_delete.add(session_id)
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                    except Exception:
-                        pass
-            for session_id in sessions_to_delete:
-                session_dir = os.path.join('downloads', session_id)
-                if os.path.exists(session_dir):
-                    import shutil
-                    try:
-                        shutil.rmtree(session_dir)
-                    except Exception:
-                        pass
-            conn.execute('DELETE FROM downloads WHERE created_at < ?', (expiration,))
-            conn.commit()
-
-    # Also check flask_session folder for expired sessions
-    import glob
-    session_dir = 'flask_session'
-    if os.path.exists(session_dir):
-        for session_file in glob.glob(os.path.join(session_dir, 'sess_*')):
-            try:
-                file_mtime = os.path.getmtime(session_file)
-                if (datetime.datetime.now() - datetime.datetime.fromtimestamp(file_mtime)).total_seconds() > 30:
-                    session_id = None
-                    with open(session_file, 'rb') as f:
-                        import pickle
-                        data = pickle.load(f)
-                        session_id = data.get('session_id')
-                    os.remove(session_file)
-                    if session_id:
-                        session_dir = os.path.join('downloads', session_id)
-                        if os.path.exists(session_dir):
-                            import shutil
-                            shutil.rmtree(session_dir)
-            except Exception:
-                pass
+# Flask's signed cookie session: it only holds session_id, so there is no server-side session storage
+app.config['SECRET_KEY'] = get_secret_key()
+app.config['PERMANENT_SESSION_LIFETIME'] = SESSION_LIFETIME
 
 @app.route('/')
 def home():
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
         session.permanent = True
+        touch_session(session['session_id'])
     return render_template(
         'index.html',
         audio_formats=AUDIO_FORMATS,
@@ -181,11 +57,15 @@ def download_audio():
     start_time = request.form.get('start_time', '')
     end_time = request.form.get('end_time', '')
 
-    # Validate inputs
+    # Only local checks here; URL accessibility is checked by the worker ('Validating' stage)
     is_valid, error = is_valid_url(url)
     if not is_valid:
         return jsonify({'error': error}), 400
 
+    is_valid, error = is_valid_audio_format(format_type, bitrate)
+    if not is_valid:
+        return jsonify({'error': error}), 400
+
     is_valid, error = is_valid_time_format(start_time)
     if not is_valid:
         return jsonify({'error': f"Invalid start time: {error}"}), 400
@@ -197,41 +77,57 @@ def download_audio():
     # Check if end_time is after start_time if both are provided
     if start_time and end_time:
         try:
-            def to_seconds(time_str):
-                parts = time_str.split(':')
-                if len(parts) == 3:
-                    return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
-                return int(parts[0]) * 60 + int(parts[1])
-            
-            if to_seconds(end_time) <= to_seconds(start_time):
+            if time_to_seconds(end_time) <= time_to_seconds(start_time):
                 return jsonify({'error': "End time must be after start time"}), 400
         except ValueError:
             return jsonify({'error': "Error parsing time values"}), 400
 
+    if is_playlist(url) and (start_time or end_time):
+        return jsonify({'error': 'Trimming not supported for playlists'}), 400
+
     session_id = session.get('session_id', str(uuid.uuid4()))
     session['session_id'] = session_id
     session.permanent = True
+    touch_session(session_id)
     download_id = str(uuid.uuid4())
 
     user_dir = os.path.join('downloads', session_id)
     os.makedirs(user_dir, exist_ok=True)
 
-    with db_lock:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute(
-                'INSERT INTO downloads (download_id, session_id, url, status, format_type, bitrate_or_res, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                (download_id, session_id, url, 'Pending', format_type, bitrate, datetime.datetime.now())
-            )
-            conn.commit()
+    execute(
+        'INSERT INTO downloads (download_id, session_id, url, status, format_type, bitrate_or_res, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (download_id, session_id, url, 'Pending', format_type, bitrate, datetime.datetime.now())
+    )
+
+    # Estimated from cached metadata only; the worker re-checks with full metadata
+    info = peek_cached_info(url)
+    estimate = estimate_output_size(info, format_type, bitrate, start_time, end_time)
+    decision, error = admit(download_id, session_id, estimate)
+    if decision == 'reject':
+        update_status(download_id, f'Error: {error}')
+        return jsonify({'error': error}), 507
+
+    cache_key = get_output_key(url, format_type, bitrate, start_time, end_time)
+    cached_path = fetch_cached_output(cache_key, user_dir, download_id)
+    if cached_path:
+        update_status(download_id, 'Completed', cached_path)
+        return jsonify({'download_id': download_id, 'status': 'Completed'})
+
+    if join_or_lead(cache_key, download_id):
+        return jsonify({'download_id': download_id, 'status': 'Pending'}), 202
 
     if is_playlist(url):
-        if start_time or end_time:
-            return jsonify({'error': 'Trimming not supported for playlists'}), 400
-        executor.submit(handle_playlist_download, download_id, session_id, url, format_type, bitrate, user_dir)
+        enqueue_job(download_id, 'playlist_audio', {
+            'session_id': session_id, 'url': url, 'format_type': format_type, 'bitrate': bitrate,
+            'user_dir': user_dir, 'cache_key': cache_key,
+        }, estimate_job_cost(info, 'playlist_audio', bitrate))
     else:
-        executor.submit(handle_single_audio_download, download_id, session_id, url, format_type, bitrate, start_time, end_time, user_dir)
+        enqueue_job(download_id, 'single_audio', {
+            'session_id': session_id, 'url': url, 'format_type': format_type, 'bitrate': bitrate,
+            'start_time': start_time, 'end_time': end_time, 'user_dir': user_dir, 'cache_key': cache_key,
+        }, estimate_job_cost(info, 'single_audio', bitrate, start_time, end_time))
 
-    return jsonify({'download_id': download_id, 'status': 'Pending'})
+    return jsonify({'download_id': download_id, 'status': 'Pending'}), 202
 
 @app.route('/download_video', methods=['POST'])
 def download_video():
@@ -240,292 +136,189 @@ def download_video():
     resolution = request.form.get('resolution')
     mute = request.form.get('mute', 'off') == 'on'
 
-    # Validate inputs
+    # Only local checks here; URL accessibility and 4K/2K duration limits are checked by the worker
     is_valid, error = is_valid_url(url)
     if not is_valid:
         return jsonify({'error': error}), 400
 
-    # Check video duration before proceeding
-    is_valid, error_message = check_video_duration(url, resolution, is_playlist(url))
+    is_valid, error = is_valid_video_format(format_type, resolution)
     if not is_valid:
-        return jsonify({'error': error_message}), 400
+        return jsonify({'error': error}), 400
 
     session_id = session.get('session_id', str(uuid.uuid4()))
     session['session_id'] = session_id
     session.permanent = True
+    touch_session(session_id)
     download_id = str(uuid.uuid4())
 
     user_dir = os.path.join('downloads', session_id)
     os.makedirs(user_dir, exist_ok=True)
 
-    with db_lock:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute(
-                'INSERT INTO downloads (download_id, session_id, url, status, format_type, bitrate_or_res, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                (download_id, session_id, url, 'Pending', format_type, resolution, datetime.datetime.now())
-            )
-            conn.commit()
+    execute(
+        'INSERT INTO downloads (download_id, session_id, url, status, format_type, bitrate_or_res, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (download_id, session_id, url, 'Pending', format_type, resolution, datetime.datetime.now())
+    )
+
+    # Estimated from cached metadata only; the worker re-checks with full metadata
+    info = peek_cached_info(url)
+    estimate = estimate_output_size(info, format_type, resolution, mute=mute)
+    decision, error = admit(download_id, session_id, estimate)
+    if decision == 'reject':
+        update_status(download_id, f'Error: {error}')
+        return jsonify({'error': error}), 507
+
+    cache_key = get_output_key(url, format_type, resolution, mute=mute)
+    cached_path = fetch_cached_output(cache_key, user_dir, download_id)
+    if cached_path:
+        update_status(download_id, 'Completed', cached_path)
+        return jsonify({'download_id': download_id, 'status': 'Completed'})
+
+    if join_or_lead(cache_key, download_id):
+        return jsonify({'download_id': download_id, 'status': 'Pending'}), 202
 
     if is_playlist(url):
-        executor.submit(handle_playlist_video_download, download_id, session_id, url, format_type, resolution, mute, user_dir)
+        enqueue_job(download_id, 'playlist_video', {
+            'session_id': session_id, 'url': url, 'format_type': format_type, 'resolution': resolution,
+            'mute': mute, 'user_dir': user_dir, 'cache_key': cache_key,
+        }, estimate_job_cost(info, 'playlist_video', resolution))
     else:
-        executor.submit(handle_single_video_download, download_id, session_id, url, format_type, resolution, mute, user_dir)
-
-    return jsonify({'download_id': download_id, 'status': 'Pending'})
-
-def handle_single_audio_download(download_id, session_id, url, format_type, bitrate, start_time, end_time, user_dir):
-    """Handle downloading a single audio file."""
-    update_status(download_id, 'Downloading')
-    try:
-        if format_type == 'aac':
-            handle_aac_download(download_id, url, bitrate, start_time, end_time, user_dir)
-        elif format_type == 'ogg':
-            handle_ogg_download(download_id, url, bitrate, start_time, end_time, user_dir)
-        else:
-            handle_standard_audio_download(download_id, url, format_type, bitrate, start_time, end_time, user_dir)
-    except Exception as e:
-        update_status(download_id, f'Error: {str(e)}')
-        raise
-
-def handle_aac_download(download_id, url, bitrate, start_time, end_time, user_dir):
-    """Handle AAC audio download with FFmpeg conversion."""
-    try:
-        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(url, download=False)
-            safe_title = sanitize_filename(info['title'])
-        
-        download_path = os.path.join(user_dir, f'{safe_title}.webm')
-        aac_path = os.path.join(user_dir, f'{safe_title}.aac')
-
-        ydl_opts = {
-            'format': 'bestaudio[ext=webm]/bestaudio',
-            'outtmpl': download_path,
-            'quiet': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-
-        ffmpeg_cmd = ['ffmpeg', '-y', '-i', download_path]
-        if start_time:
-            ffmpeg_cmd.extend(['-ss', start_time])
-        if end_time:
-            ffmpeg_cmd.extend(['-to', end_time])
-        ffmpeg_cmd.extend(['-c:a', 'aac', '-b:a', bitrate + 'k', '-f', 'adts', aac_path])
-
-        subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-
-        if not os.path.exists(aac_path):
-            raise Exception(f"Conversion failed: {aac_path} not found")
-
-        update_status(download_id, 'Completed', aac_path)
-
-    except subprocess.CalledProcessError as e:
-        update_status(download_id, f'Error: FFmpeg failed - {e.stderr}')
-        raise
-    except Exception as e:
-        update_status(download_id, f'Error: {str(e)}')
-        raise
-
-def handle_ogg_download(download_id, url, bitrate, start_time, end_time, user_dir):
-    """Handle OGG audio download with FFmpeg conversion."""
-    try:
-        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(url, download=False)
-            safe_title = sanitize_filename(info['title'])
-        
-        download_path = os.path.join(user_dir, f'{safe_title}.webm')
-        ogg_path = os.path.join(user_dir, f'{safe_title}.ogg')
-
-        ydl_opts = {
-            'format': 'bestaudio[ext=webm]/bestaudio',
-            'outtmpl': download_path,
-            'quiet': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-
-        ffmpeg_cmd = ['ffmpeg', '-y', '-i', download_path]
-        if start_time:
-            ffmpeg_cmd.extend(['-ss', start_time])
-        if end_time:
-            ffmpeg_cmd.extend(['-to', end_time])
-        ffmpeg_cmd.extend(['-c:a', 'libvorbis', '-b:a', bitrate + 'k', ogg_path])
-
-        subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True)
-
-        if not os.path.exists(ogg_path):
-            raise Exception(f"Conversion failed: {ogg_path} not found")
-
-        update_status(download_id, 'Completed', ogg_path)
-        
-    except subprocess.CalledProcessError as e:
-        update_status(download_id, f'Error: FFmpeg failed - {e.stderr}')
-        raise
-    except Exception as e:
-        update_status(download_id, f'Error: {str(e)}')
-        raise
-
-def handle_standard_audio_download(download_id, url, format_type, bitrate, start_time, end_time, user_dir):
-    """Handle standard audio download (mp3, m4a)."""
-    try:
-        ydl_opts = {
-            'format': 'bestaudio',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': format_type,
-                'preferredquality': bitrate,
-            }],
-            'outtmpl': os.path.join(user_dir, '%(title)s.%(ext)s'),
-        }
-        if start_time and end_time:
-            ydl_opts['postprocessor_args'] = ['-ss', start_time, '-to', end_time]
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info).replace('.webm', f'.{format_type}').replace('.m4a', f'.{format_type}')
-            if not os.path.exists(filename):
-                raise Exception(f"File not found: {filename}")
-        
-        update_status(download_id, 'Completed', filename)
-    except Exception as e:
-        update_status(download_id, f'Error: {str(e)}')
-        raise
-
-def handle_playlist_download(download_id, session_id, url, format_type, bitrate, user_dir):
-    """Handle downloading an audio playlist."""
-
-    update_status(download_id, 'Downloading')
-    try:
-        with yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
-            playlist_info = ydl.extract_info(url, download=False)
-            if not playlist_info:
-                raise Exception("Could not retrieve playlist information")
-            playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_info.get('title', 'playlist'))
-
-        timestamp = get_timestamp()
-        playlist_dir = os.path.join(user_dir, f"{playlist_title}_{timestamp}")
-        os.makedirs(playlist_dir, exist_ok=True)
-
-        ydl_opts = {
-            'format': 'bestaudio',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'aac' if format_type == 'aac' else 'vorbis' if format_type == 'ogg' else format_type,
-                'preferredquality': bitrate,
-            }],
-            'outtmpl': f'{playlist_dir}/%(title)s.%(ext)s',
-            'ignoreerrors': True,
-        }
-        if format_type == 'aac':
-            ydl_opts['postprocessor_args'] = ['-f', 'adts']
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.extract_info(url, download=True)
-
-        zip_path = os.path.join(user_dir, f"{playlist_title}_{timestamp}.zip")
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, _, files in os.walk(playlist_dir):
-                for file in files:
-                    expected_ext = '.aac' if format_type == 'aac' else '.ogg' if format_type == 'ogg' else f'.{format_type}'
-                    if file.endswith(expected_ext):
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, user_dir)
-                        zipf.write(file_path, arcname)
-
-        update_status(download_id, 'Completed', zip_path)
-    except Exception as e:
-        update_status(download_id, f'Error: {str(e)}')
-        raise
-
-def handle_single_video_download(download_id, session_id, url, format_type, resolution, mute, user_dir):
-    """Handle downloading a single video file."""
-
-    update_status(download_id, 'Downloading')
-    try:
-        ydl_opts = {
-            'format': f'bestvideo[height<={RESOLUTIONS[resolution]}]+bestaudio/best[height<={RESOLUTIONS[resolution]}]' if not mute else f'bestvideo[height<={RESOLUTIONS[resolution]}]',
-            'merge_output_format': format_type,
-            'outtmpl': os.path.join(user_dir, '%(title)s.%(ext)s'),
-        }
-        if mute:
-            ydl_opts['postprocessors'] = [{
-                'key': 'FFmpegVideoRemuxer',
-                'preferedformat': format_type,
-            }]
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            if mute:
-                filename = os.path.splitext(filename)[0] + f'.{format_type}'
-            if not os.path.exists(filename):
-                raise Exception(f"File not found: {filename}")
-        
-        update_status(download_id, 'Completed', filename)
-    except Exception as e:
-        update_status(download_id, f'Error: {str(e)}')
-        raise
-
-def handle_playlist_video_download(download_id, session_id, url, format_type, resolution, mute, user_dir):
-    """Handle downloading a video playlist."""
-    update_status(download_id, 'Downloading')
-    try:
-        with yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
-            playlist_info = ydl.extract_info(url, download=False)
-            if not playlist_info:
-                raise Exception("Could not retrieve playlist information")
-            playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_info.get('title', 'playlist'))
-
-        timestamp = get_timestamp()
-        playlist_dir = os.path.join(user_dir, f"{playlist_title}_{timestamp}")
-        os.makedirs(playlist_dir, exist_ok=True)
-
-        ydl_opts = {
-            'format': f'bestvideo[height<={RESOLUTIONS[resolution]}]+bestaudio/best[height<={RESOLUTIONS[resolution]}]' if not mute else f'bestvideo[height<={RESOLUTIONS[resolution]}]',
-            'merge_output_format': format_type,
-            'outtmpl': f'{playlist_dir}/%(title)s.%(ext)s',
-            'ignoreerrors': True,
-        }
-        if mute:
-            ydl_opts['postprocessors'] = [{
-                'key': 'FFmpegVideoRemuxer',
-                'preferedformat': format_type,
-            }]
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.extract_info(url, download=True)
-        zip_path = os.path.join(user_dir, f"{playlist_title}_{timestamp}.zip")
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, _, files in os.walk(playlist_dir):
-                for file in files:
-                    if file.endswith(f'.{format_type}'):
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, user_dir)
-                        zipf.write(file_path, arcname)
-
-        update_status(download_id, 'Completed', zip_path)
-    except Exception as e:
-        update_status(download_id, f'Error: {str(e)}')
-        raise
-    
+        enqueue_job(download_id, 'single_video', {
+            'session_id': session_id, 'url': url, 'format_type': format_type, 'resolution': resolution,
+            'mute': mute, 'user_dir': user_dir, 'cache_key': cache_key,
+        }, estimate_job_cost(info, 'single_video', resolution))
+
+    return jsonify({'download_id': download_id, 'status': 'Pending'}), 202
+
+# One row per download. Downloads attached to an identical running job (leader_id) report the
+# leader's status and progress; playlist entry counts come from playlist_entries.
+STATUS_QUERY = (
+    'SELECT d.download_id, d.file_path, COALESCE(l.status, d.status) AS status, '
+    'COALESCE(l.download_id, d.download_id) AS job_id, '
+    'COALESCE(l.transcode_plan, d.transcode_plan) AS transcode_plan, '
+    + ', '.join(f'CASE WHEN l.download_id IS NULL THEN d.{field} ELSE l.{field} END AS {field}' for field in PROGRESS_FIELDS)
+    + ", (SELECT COUNT(*) FROM playlist_entries e WHERE e.download_id = d.download_id) AS entries_total"
+    ", (SELECT COUNT(*) FROM playlist_entries e WHERE e.download_id = d.download_id AND e.status = 'Completed') AS entries_completed"
+    ", (SELECT COUNT(*) FROM playlist_entries e WHERE e.download_id = d.download_id AND e.status LIKE 'Error%') AS entries_failed"
+    ' FROM downloads d LEFT JOIN downloads l ON l.download_id = d.leader_id'
+    " AND l.status != 'Completed' AND l.status NOT LIKE 'Error%'"
+)
+
+def fetch_statuses(where, params):
+    """Return status dicts for the downloads matching a WHERE clause on the downloads row (alias d)."""
+    rows = query_all(f'{STATUS_QUERY} WHERE {where} ORDER BY d.created_at', params)
+    queue_positions = get_queue_positions() if any(row['status'] == 'Pending' for row in rows) else {}
+    statuses = []
+    for row in rows:
+        status = {key: row[key] for key in ('download_id', 'status', 'file_path', 'transcode_plan') + PROGRESS_FIELDS}
+        if row['job_id'] in queue_positions:
+            status['queue_position'] = queue_positions[row['job_id']]
+        if row['entries_total']:
+            status['entries'] = {
+                'total': row['entries_total'],
+                'completed': row['entries_completed'],
+                'failed': row['entries_failed'],
+            }
+        statuses.append(status)
+    return statuses
+
 @app.route('/status/<download_id>')
 def check_status(download_id):
     """Check the status of a download."""
-    cleanup_expired_sessions()
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute('SELECT status, file_path FROM downloads WHERE download_id = ?', (download_id,))
-        result = cursor.fetchone()
-        if result:
-            status, file_path = result
-            return jsonify({'download_id': download_id, 'status': status, 'file_path': file_path})
-        return jsonify({'error': 'Download not found'}), 404
+    statuses = fetch_statuses('d.download_id = ?', (download_id,))
+    if statuses:
+        return jsonify(statuses[0])
+    return jsonify({'error': 'Download not found'}), 404
+
+@app.route('/session_status')
+def session_status():
+    """Return the status of every download in the current session with a single query."""
+    session_id = session.get('session_id')
+    if not session_id:
+        return jsonify({'downloads': []})
+    return jsonify({'downloads': fetch_statuses('d.session_id = ?', (session_id,))})
+
+# Each open stream holds one of the worker's threads, so only SSE_MAX_STREAMS may be open at once
+sse_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+@app.route('/events')
+def status_events():
+    """
+    Server-Sent Events stream of the session's downloads. A download is sent when it first
+    appears and again only when its row changes. The stream ends after SSE_STREAM_DURATION
+    seconds and the browser's EventSource reconnects on its own. Answers 503 when the worker
+    already has SSE_MAX_STREAMS streams open; the browser then polls /session_status.
+    """
+    if not sse_streams.acquire(blocking=False):
+        return Response(status=503, headers={'Retry-After': str(SSE_STREAM_DURATION)})
+    session_id = session.get('session_id')
+
+    def generate():
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        last_sent = {}
+        started = last_write = time.monotonic()
+        while time.monotonic() - started < SSE_STREAM_DURATION:
+            for status in fetch_statuses('d.session_id = ?', (session_id,)) if session_id else []:
+                payload = json.dumps(status)
+                if last_sent.get(status['download_id']) != payload:
+                    last_sent[status['download_id']] = payload
+                    last_write = time.monotonic()
+                    yield f'data: {payload}\n\n'
+            if time.monotonic() - last_write >= SSE_KEEPALIVE_INTERVAL:
+                last_write = time.monotonic()
+                yield ': keepalive\n\n'
+            time.sleep(SSE_POLL_INTERVAL)
+
+    response = Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Called by the server when the stream ends or the client goes away
+    response.call_on_close(sse_streams.release)
+    return response
 
 @app.route('/download/<download_id>')
 def download_file(download_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        cursor = conn.execute('SELECT file_path FROM downloads WHERE download_id = ?', (download_id,))
-        result = cursor.fetchone()
-        if result and result[0] and os.path.exists(result[0]):
-            return send_file(result[0], as_attachment=True)
-        return jsonify({'error': 'File not found'}), 404
+    result = query_one('SELECT file_path FROM downloads WHERE download_id = ?', (download_id,))
+    if result and result[0]:
+        # Least recently downloaded files are evicted first when the disk budget runs out
+        execute('UPDATE downloads SET last_accessed = ? WHERE download_id = ?', (time.time(), download_id))
+    if result and result[0] and os.path.isdir(result[0]) and has_zip_manifest(result[0]):
+        return stream_zip(result[0])
+    if result and result[0] and os.path.isfile(result[0]):
+        return send_download(result[0])
+    return jsonify({'error': 'File not found'}), 404
+
+@app.route('/cache_stats')
+def cache_stats():
+    """Report metadata cache hit/miss counters."""
+    return jsonify(get_cache_stats())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of the web and worker processes, summed across processes."""
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/trace/<download_id>')
+def job_trace(download_id):
+    """Timeline of a job's stages (queue wait, extract_info, download, merge, ffmpeg, zip...) and its profile."""
+    if not query_one('SELECT 1 FROM downloads WHERE download_id = ?', (download_id,)):
+        return jsonify({'error': 'Download not found'}), 404
+    return jsonify(get_job_trace(download_id))
+
+@app.route('/trace_stats')
+def trace_stats():
+    """Per-stage duration percentiles, bytes and CPU time of recent jobs."""
+    return jsonify(get_stage_stats(TRACE_STATS_WINDOW))
+
+@app.route('/storage')
+def storage_usage():
+    """Report the disk space used by the current session and in total, with the limits."""
+    return jsonify(get_storage_usage(session.get('session_id')))
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server: run the job worker in-process instead of via worker.py
+    from worker import start_session_sweeper, start_worker_threads
+    start_worker_threads(get_safe_thread_count())
+    start_session_sweeper()
+    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,404 @@
+"""
+Offline load test for the web app and the job workers.
+
+Starts, in a temporary working directory:
+- the local media server (media_server.py) standing in for YouTube,
+- the web app (Gunicorn with the production worker class, or Werkzeug with --server werkzeug),
+- worker.py, with the bench extractor plugin on its path so yt_dlp never reaches YouTube.
+
+Then --clients concurrent clients, each with its own session, submit --jobs downloads
+(/download_audio, /download_video), poll /status/<download_id> until they finish and fetch
+/download/<download_id>. Reported: jobs/sec, p50/p95/p99 latency per endpoint, end-to-end
+job time, time spent in each stage, and peak disk use and RSS of the app and workers.
+
+Requires FFmpeg (for the synthetic media and the jobs themselves). Worker settings come from
+the environment as usual, e.g. THREAD_COUNT=4 WORKER_PROCESSES=2 python benchmarks/load_test.py
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import queue
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from config import RESOLUTIONS  # noqa: E402
+from media_server import MediaServer, make_nonce, playlist_url, video_url  # noqa: E402
+
+SAMPLE_INTERVAL = 0.5  # seconds between disk/RSS samples
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def dir_size(path, exclude=()):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [name for name in dirs if os.path.join(root, name) not in exclude]
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants (Linux /proc)."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending += [int(child) for child in f.read().split()]
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def parse_mix(mix):
+    """'audio=3,video=1,playlist=1' -> [('audio', 3), ...]"""
+    weights = []
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('audio', 'video', 'playlist_audio', 'playlist_video'):
+            raise ValueError(f'Unknown job kind in --mix: {kind}')
+        weights.append((kind, float(weight or 1)))
+    return weights
+
+
+def build_jobs(args):
+    """The list of (kind, endpoint, form) submissions for this run."""
+    rng = random.Random(args.seed)
+    kinds = parse_mix(args.mix)
+    height = int(args.resolution_height)
+    jobs, urls = [], defaultdict(list)
+    for _ in range(args.jobs):
+        kind = rng.choices([k for k, _ in kinds], [w for _, w in kinds])[0]
+        if urls[kind] and rng.random() < args.repeat:
+            url = rng.choice(urls[kind])  # identical request: exercises the caches and job coalescing
+        elif kind.startswith('playlist'):
+            url = playlist_url(args.playlist_size, args.media_duration, height, make_nonce(rng))
+        else:
+            url = video_url(args.media_duration, height, make_nonce(rng))
+        urls[kind].append(url)
+        if kind in ('audio', 'playlist_audio'):
+            form = {'url': url, 'format': args.audio_format, 'bitrate': args.bitrate}
+            if kind == 'audio' and args.trim:
+                form['start_time'], form['end_time'] = args.trim.split('-')
+            jobs.append((kind, 'download_audio', form))
+        else:
+            form = {'url': url, 'format': args.video_format, 'resolution': args.resolution}
+            if args.mute:
+                form['mute'] = 'on'
+            jobs.append((kind, 'download_video', form))
+    return jobs
+
+
+class Client:
+    """One browser session: a cookie jar and the latencies of its requests."""
+
+    def __init__(self, base_url, latencies, lock):
+        self.base_url = base_url
+        self.latencies = latencies
+        self.lock = lock
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, endpoint, path, data=None):
+        """Returns (status code, body bytes); the time to the last byte is recorded under endpoint."""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        started = time.monotonic()
+        try:
+            with self.opener.open(f'{self.base_url}{path}', data=body, timeout=600) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, content = e.code, e.read()
+        with self.lock:
+            self.latencies[endpoint].append(time.monotonic() - started)
+        return status, content
+
+    def run_job(self, kind, endpoint, form, poll_interval):
+        """Submit, poll and download one job. Returns a result dict."""
+        started = time.monotonic()
+        status_code, content = self.request(endpoint, f'/{endpoint}', form)
+        result = {'kind': kind, 'stages': defaultdict(float), 'ok': False}
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = {}
+        if status_code not in (200, 202) or 'download_id' not in data:
+            result['error'] = data.get('error') or f'HTTP {status_code}'
+            result['e2e'] = time.monotonic() - started
+            return result
+
+        download_id, status = data['download_id'], data
+        last_label, last_time = 'Submitted', time.monotonic()
+        while status.get('status') != 'Completed' and not str(status.get('status', '')).startswith('Error'):
+            time.sleep(poll_interval)
+            _, content = self.request('status', f'/status/{download_id}')
+            try:
+                status = json.loads(content)
+            except ValueError:
+                continue
+            now = time.monotonic()
+            result['stages'][last_label] += now - last_time
+            last_label = status.get('stage') or status.get('status') or 'Unknown'
+            last_time = now
+
+        if status['status'] != 'Completed':
+            result['error'] = status['status']
+        else:
+            fetch_started = time.monotonic()
+            status_code, content = self.request('download', f'/download/{download_id}')
+            result['stages']['Fetching'] += time.monotonic() - fetch_started
+            result['ok'] = status_code == 200
+            result['bytes'] = len(content)
+            if not result['ok']:
+                result['error'] = f'Download returned HTTP {status_code}'
+        result['e2e'] = time.monotonic() - started
+        return result
+
+
+class Sampler:
+    """Samples disk use of the working directory and RSS of the server processes."""
+
+    def __init__(self, path, pids, exclude=()):
+        self.path = path
+        self.pids = pids
+        self.exclude = exclude
+        self.peak_disk = 0
+        self.peak_rss = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            disk = dir_size(self.path, self.exclude)
+            self.peak_disk = max(self.peak_disk, disk)
+            self.peak_rss = max(self.peak_rss, sum(tree_rss(pid) for pid in self.pids))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def start_processes(args, workdir, media_url):
+    """Start the web app and worker.py. Returns (app_url, [processes])."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_DIR, BENCH_DIR, env.get('PYTHONPATH')]))
+    env['BENCH_MEDIA_SERVER'] = media_url
+    port = args.port or free_port()
+    if args.server == 'gunicorn':
+        app_cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+                   '-w', str(args.web_workers), '--threads', str(args.web_threads), '-b', f'127.0.0.1:{port}', 'app:app']
+    else:
+        app_cmd = [sys.executable, '-c',
+                   'from werkzeug.serving import run_simple; from app import app; '
+                   f'run_simple("127.0.0.1", {port}, app, threaded=True)']
+    log = open(os.path.join(workdir, 'server.log'), 'ab')
+    # Own process groups, so the worker's child processes are stopped with it
+    processes = [
+        subprocess.Popen(app_cmd, cwd=workdir, env=env, stdout=log, stderr=log, start_new_session=True),
+        subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'worker.py')], cwd=workdir, env=env,
+                         stdout=log, stderr=log, start_new_session=True),
+    ]
+    app_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(app_url, timeout=5).read()
+            return app_url, processes
+        except OSError:
+            if any(process.poll() is not None for process in processes):
+                break
+            time.sleep(0.5)
+    stop_processes(processes)
+    raise RuntimeError(f'The app did not start, see {os.path.join(workdir, "server.log")}')
+
+
+def stop_processes(processes):
+    for process in processes:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def summarize(latencies, results, wall_time, sampler):
+    def stats(values):
+        return {
+            'count': len(values),
+            'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99),
+            'max': max(values) if values else None,
+        }
+
+    stages = defaultdict(list)
+    for result in results:
+        for stage, seconds in result['stages'].items():
+            stages[stage].append(seconds)
+    completed = [result for result in results if result['ok']]
+    return {
+        'wall_time': wall_time,
+        'jobs': len(results),
+        'completed': len(completed),
+        'failed': len(results) - len(completed),
+        'jobs_per_sec': len(completed) / wall_time if wall_time else 0,
+        'endpoints': {endpoint: stats(values) for endpoint, values in sorted(latencies.items())},
+        'end_to_end': stats([result['e2e'] for result in completed]),
+        'stages': {stage: dict(stats(values), mean=sum(values) / len(values)) for stage, values in stages.items()},
+        'errors': sorted({result['error'] for result in results if result.get('error')}),
+        'peak_disk_bytes': sampler.peak_disk,
+        'peak_rss_bytes': sampler.peak_rss,
+    }
+
+
+def print_report(summary):
+    def ms(seconds):
+        return '-' if seconds is None else f'{seconds * 1000:.0f}'
+
+    print(f"\nJobs: {summary['completed']} completed, {summary['failed']} failed in {summary['wall_time']:.1f}s "
+          f"({summary['jobs_per_sec']:.2f} jobs/sec)")
+    print(f"Peak disk: {summary['peak_disk_bytes'] / 1024**2:.1f} MB, peak RSS: {summary['peak_rss_bytes'] / 1024**2:.1f} MB")
+    print(f"\n{'Latency (ms)':<24}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    rows = [(f'/{endpoint}', stats) for endpoint, stats in summary['endpoints'].items()]
+    rows.append(('end-to-end job', summary['end_to_end']))
+    for name, stats in rows:
+        print(f"{name:<24}{stats['count']:>8}{ms(stats['p50']):>10}{ms(stats['p95']):>10}{ms(stats['p99']):>10}{ms(stats['max']):>10}")
+    print(f"\n{'Stage time (ms)':<24}{'jobs':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+    for stage, stats in sorted(summary['stages'].items()):
+        print(f"{stage:<24}{stats['count']:>8}{ms(stats['mean']):>10}{ms(stats['p50']):>10}{ms(stats['p95']):>10}{ms(stats['max']):>10}")
+    if summary['errors']:
+        print('\nFailures:')
+    for error in summary['errors']:
+        print(f'  {error}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test of the downloader against a local media server.')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent client sessions')
+    parser.add_argument('--jobs', type=int, default=20, help='downloads submitted in total')
+    parser.add_argument('--mix', default='audio=3,video=1,playlist_audio=1',
+                        help='job kinds and weights: audio, video, playlist_audio, playlist_video')
+    parser.add_argument('--media-duration', type=int, default=30, help='seconds of synthetic media per video')
+    parser.add_argument('--resolution', default='720p', help='requested video resolution (also the source maximum)')
+    parser.add_argument('--audio-format', default='mp3')
+    parser.add_argument('--bitrate', default='128')
+    parser.add_argument('--video-format', default='mp4')
+    parser.add_argument('--mute', action='store_true', help='request muted videos')
+    parser.add_argument('--trim', help='trim single audio jobs, e.g. 00:05-00:20')
+    parser.add_argument('--playlist-size', type=int, default=5)
+    parser.add_argument('--repeat', type=float, default=0.0,
+                        help='fraction of jobs that repeat an earlier URL (cache and coalescing hits)')
+    parser.add_argument('--rate', type=int, help='media server bytes/sec per response (default: unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='media server seconds per response')
+    parser.add_argument('--poll-interval', type=float, default=0.25, help='seconds between /status polls')
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn')
+    parser.add_argument('--web-workers', type=int, default=4)
+    parser.add_argument('--web-threads', type=int, default=8)
+    parser.add_argument('--port', type=int, help='web app port (default: a free port)')
+    parser.add_argument('--media-cache', help='directory for generated media, kept between runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    args = parser.parse_args()
+
+    if args.resolution not in RESOLUTIONS:
+        parser.error(f'--resolution must be one of {", ".join(RESOLUTIONS)}')
+    args.resolution_height = RESOLUTIONS[args.resolution]
+    if not shutil.which('ffmpeg'):
+        parser.error('FFmpeg is required')
+
+    workdir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    media_dir = os.path.abspath(args.media_cache or os.path.join(workdir, 'media'))
+    media_server = MediaServer(media_dir, rate=args.rate, latency=args.latency)
+    media_url = media_server.start()
+    processes = []
+    try:
+        app_url, processes = start_processes(args, workdir, media_url)
+        print(f'Working directory {workdir}, app {app_url}, media {media_url}')
+
+        jobs = queue.Queue()
+        for job in build_jobs(args):
+            jobs.put(job)
+        latencies, results, lock = defaultdict(list), [], threading.Lock()
+
+        def client_loop():
+            client = Client(app_url, latencies, lock)
+            client.request('home', '/')
+            while True:
+                try:
+                    kind, endpoint, form = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                result = client.run_job(kind, endpoint, form, args.poll_interval)
+                with lock:
+                    results.append(result)
+                    print(f"[{len(results)}/{args.jobs}] {kind}: {'ok' if result['ok'] else result.get('error')} "
+                          f"in {result['e2e']:.1f}s")
+
+        sampler = Sampler(workdir, [process.pid for process in processes], exclude=[media_dir])
+        sampler.start()
+        started = time.monotonic()
+        threads = [threading.Thread(target=client_loop) for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.monotonic() - started
+        sampler.stop()
+
+        summary = summarize(latencies, results, wall_time, sampler)
+        summary['settings'] = {key: value for key, value in vars(args).items() if key != 'json'}
+        print_report(summary)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(summary, f, indent=2)
+    finally:
+        stop_processes(processes)
+        media_server.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Local stand-in for YouTube used by the benchmark suite.
+
+Serves metadata for synthetic videos and playlists (read by the extractor in
+yt_dlp_plugins/extractor/bench.py) and the media files themselves. Files are generated once
+per duration and resolution from FFmpeg's lavfi test sources and kept in cache_dir.
+
+Video IDs encode what to serve, so no state is shared with the extractor:
+- video: 'b' + duration in seconds (4 digits) + height index (HEIGHTS) + 5-character nonce
+- playlist: 'bench-<entries>-<duration>-<height index>-<nonce>'
+Different nonces give different IDs for the same media, so jobs are not answered from the
+app's metadata and output caches unless a benchmark asks for it.
+
+Run standalone with: python benchmarks/media_server.py --port 8765
+"""
+import argparse
+import json
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RESOLUTIONS  # noqa: E402
+
+HEIGHTS = sorted(int(height) for height in RESOLUTIONS.values())
+VIDEO_BITRATES = {144: 100, 240: 250, 360: 500, 480: 1000, 720: 2500, 1080: 4500, 1440: 9000, 2160: 18000}  # kbit/s
+AUDIO_FORMATS = {
+    # format_id: (ext, acodec, kbit/s, ffmpeg encoder)
+    '140': ('m4a', 'mp4a.40.2', 128, 'aac'),
+    '251': ('webm', 'opus', 160, 'libopus'),
+}
+BLOCK_SIZE = 64 * 1024
+
+VIDEO_ID_REGEX = r'b(\d{4})(\d)([0-9a-z]{5})'
+PLAYLIST_ID_REGEX = r'bench-(\d+)-(\d+)-(\d)-([0-9a-z]{5})'
+
+
+def make_nonce(rng=random):
+    return ''.join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(5))
+
+
+def video_url(duration, height, nonce):
+    """YouTube-style watch URL of a synthetic video."""
+    return f'https://www.youtube.com/watch?v=b{int(duration):04d}{HEIGHTS.index(int(height))}{nonce}'
+
+
+def playlist_url(entries, duration, height, nonce):
+    """YouTube-style playlist URL of entries synthetic videos of about duration seconds each."""
+    return f'https://www.youtube.com/playlist?list=bench-{entries}-{duration}-{HEIGHTS.index(int(height))}-{nonce}'
+
+
+def _video_info(base_url, video_id):
+    match = re.fullmatch(VIDEO_ID_REGEX, video_id)
+    if not match:
+        return None
+    duration, max_height = int(match.group(1)), HEIGHTS[int(match.group(2))]
+    formats = [
+        {
+            'format_id': format_id, 'url': f'{base_url}/media/a{format_id}-{duration}.{ext}', 'ext': ext,
+            'acodec': acodec, 'vcodec': 'none', 'abr': bitrate, 'tbr': bitrate,
+            'filesize_approx': duration * bitrate * 125, 'protocol': 'http',
+        }
+        for format_id, (ext, acodec, bitrate, _) in AUDIO_FORMATS.items()
+    ]
+    formats += [
+        {
+            'format_id': f'v{height}', 'url': f'{base_url}/media/v{height}-{duration}.mp4', 'ext': 'mp4',
+            'vcodec': 'avc1.64001f', 'acodec': 'none', 'height': height, 'width': height * 16 // 9 // 2 * 2,
+            'fps': 25, 'tbr': VIDEO_BITRATES[height], 'filesize_approx': duration * VIDEO_BITRATES[height] * 125,
+            'protocol': 'http',
+        }
+        for height in HEIGHTS if height <= max_height
+    ]
+    return {
+        'id': video_id,
+        'title': f'Benchmark {duration}s {max_height}p {video_id}',
+        'duration': duration,
+        'formats': formats,
+    }
+
+
+def _playlist_info(playlist_id):
+    match = re.fullmatch(PLAYLIST_ID_REGEX, playlist_id)
+    if not match:
+        return None
+    count, duration, height_index, nonce = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+    rng = random.Random(playlist_id)
+    entries = []
+    for index in range(count):
+        # Slightly different durations so entries are distinct videos
+        entry_duration = duration + index % 5
+        entry_id = f'b{entry_duration:04d}{height_index}{make_nonce(rng)}'
+        entries.append({'id': entry_id, 'title': f'Benchmark entry {index + 1} ({nonce})', 'duration': entry_duration})
+    return {'id': playlist_id, 'title': f'Benchmark playlist {playlist_id}', 'entries': entries}
+
+
+class MediaServer:
+    """
+    Threaded HTTP server for /info/<video_id>, /playlist/<playlist_id> and /media/<file>.
+    Media responses support Range requests. rate limits each response to that many bytes
+    per second and latency delays every response, to approximate a remote CDN.
+    """
+
+    def __init__(self, cache_dir, host='127.0.0.1', port=0, rate=None, latency=0.0):
+        self.cache_dir = cache_dir
+        self.rate = rate
+        self.latency = latency
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f'http://{host}:{self.httpd.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def media_path(self, name):
+        """Path of a generated media file, generating it on first use (None for unknown names)."""
+        match = re.fullmatch(r'(a(\d+)|v(\d+))-(\d+)\.(m4a|webm|mp4)', name)
+        if not match:
+            return None
+        path = os.path.join(self.cache_dir, name)
+        if os.path.exists(path):
+            return path
+        with self.locks_lock:
+            lock = self.locks.setdefault(name, threading.Lock())
+        with lock:
+            if not os.path.exists(path):
+                duration = int(match.group(4))
+                if match.group(2):
+                    if match.group(2) not in AUDIO_FORMATS:
+                        return None
+                    _, _, bitrate, encoder = AUDIO_FORMATS[match.group(2)]
+                    source = f'sine=frequency=440:sample_rate=48000:duration={duration}'
+                    codec_args = ['-c:a', encoder, '-b:a', f'{bitrate}k']
+                else:
+                    height = int(match.group(3))
+                    if height not in VIDEO_BITRATES:
+                        return None
+                    source = f'testsrc2=size={height * 16 // 9 // 2 * 2}x{height}:rate=25:duration={duration}'
+                    codec_args = ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                                  '-b:v', f'{VIDEO_BITRATES[height]}k', '-movflags', '+faststart']
+                tmp_path = f'{path}.part'
+                subprocess.run(
+                    ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', source, *codec_args,
+                     '-f', 'webm' if name.endswith('.webm') else 'mp4', tmp_path],
+                    check=True
+                )
+                os.replace(tmp_path, path)
+        return path
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, data):
+                if data is None:
+                    self.send_error(404)
+                    return
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_HEAD(self):
+                self.do_GET(head=True)
+
+            def do_GET(self, head=False):
+                if server.latency:
+                    time.sleep(server.latency)
+                base_url = f'http://{self.headers.get("Host") or server.base_url[7:]}'
+                if self.path.startswith('/info/'):
+                    return self._send_json(_video_info(base_url, self.path[6:]))
+                if self.path.startswith('/playlist/'):
+                    return self._send_json(_playlist_info(self.path[10:]))
+                if not self.path.startswith('/media/'):
+                    return self.send_error(404)
+
+                try:
+                    path = server.media_path(self.path[7:])
+                except (OSError, subprocess.CalledProcessError) as e:
+                    return self.send_error(500, str(e))
+                if not path:
+                    return self.send_error(404)
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+                if match and (match.group(1) or match.group(2)):
+                    if match.group(1):
+                        start = int(match.group(1))
+                        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                    else:
+                        start = max(0, size - int(match.group(2)))
+                    if start >= size or start > end:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                if head:
+                    return
+
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    remaining = end - start + 1
+                    started = time.monotonic()
+                    sent = 0
+                    while remaining > 0:
+                        chunk = f.read(min(BLOCK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        try:
+                            self.wfile.write(chunk)
+                        except (BrokenPipeError, ConnectionResetError):
+                            return
+                        remaining -= len(chunk)
+                        sent += len(chunk)
+                        if server.rate:
+                            delay = sent / server.rate - (time.monotonic() - started)
+                            if delay > 0:
+                                time.sleep(delay)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve synthetic YouTube-like media for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-dir', default=os.path.join('benchmarks', '.media'))
+    parser.add_argument('--rate', type=int, help='bytes per second per response (default: unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    args = parser.parse_args()
+
+    server = MediaServer(args.cache_dir, args.host, args.port, args.rate, args.latency)
+    print(f'Serving on {server.base_url} (set BENCH_MEDIA_SERVER to this for the worker)')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Startup benchmark for the web app under Gunicorn.
+
+Starts Gunicorn with gunicorn.conf.py in a fresh temporary working directory (so the database
+is created as on a first start) and measures, from spawning it:
+- the time until the first request to / is served,
+- the time until all --web-workers workers are ready (their post_worker_init log line),
+- the proportional set size (PSS) of the master and workers once they are all ready; unlike
+  RSS it counts the pages workers share with the preloading master once.
+
+Each --modes entry ('preload': the master imports the app and forks the workers, 'no-preload':
+every worker imports it, WEB_PRELOAD=0) is started --runs times and the median reported.
+Does not need FFmpeg or the job worker, e.g. python benchmarks/startup_test.py --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from load_test import free_port  # noqa: E402
+
+READY_LINE = b'Worker ready'
+TIMEOUT = 60
+
+
+def tree_pss(pid):
+    """Proportional set size in bytes of a process and its children (Linux /proc)."""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                for line in f:
+                    if line.startswith('Pss:'):
+                        total += int(line.split()[1]) * 1024
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending += [int(child) for child in f.read().split()]
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def start_once(preload, args):
+    """Start Gunicorn once. Returns {'first_request', 'all_ready', 'pss'} (seconds, bytes)."""
+    workdir = tempfile.mkdtemp(prefix='ytdl-startup-')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])),
+               WEB_PRELOAD='1' if preload else '0')
+    url = f'http://127.0.0.1:{free_port()}'
+    log_path = os.path.join(workdir, 'server.log')
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+           '-w', str(args.web_workers), '--threads', str(args.web_threads), '-b', url[len('http://'):], 'app:app']
+    started = time.monotonic()
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=log, start_new_session=True)
+    result = {}
+    try:
+        while len(result) < 2:
+            if time.monotonic() - started > TIMEOUT or process.poll() is not None:
+                raise RuntimeError(f'Gunicorn did not start, see {log_path}')
+            if 'first_request' not in result:
+                try:
+                    urllib.request.urlopen(url, timeout=5).read()
+                    result['first_request'] = time.monotonic() - started
+                except OSError:
+                    pass
+            if 'all_ready' not in result:
+                with open(log_path, 'rb') as f:
+                    if f.read().count(READY_LINE) >= args.web_workers:
+                        result['all_ready'] = time.monotonic() - started
+            time.sleep(0.01)
+        result['pss'] = tree_pss(process.pid)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time from starting Gunicorn until the app serves requests.')
+    parser.add_argument('--modes', default='preload,no-preload', help='comma-separated: preload, no-preload')
+    parser.add_argument('--runs', type=int, default=3, help='starts per mode')
+    parser.add_argument('--web-workers', type=int, default=4)
+    parser.add_argument('--web-threads', type=int, default=8)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the working directories')
+    args = parser.parse_args()
+    modes = args.modes.split(',')
+    if any(mode not in ('preload', 'no-preload') for mode in modes):
+        parser.error('--modes takes preload and no-preload')
+
+    summary = {}
+    for mode in modes:
+        runs = []
+        for run in range(args.runs):
+            runs.append(start_once(mode == 'preload', args))
+            print(f"{mode} run {run + 1}: first request {runs[-1]['first_request'] * 1000:.0f} ms, "
+                  f"all workers ready {runs[-1]['all_ready'] * 1000:.0f} ms")
+        summary[mode] = {
+            key: statistics.median(result[key] for result in runs) for key in ('first_request', 'all_ready', 'pss')
+        }
+
+    print(f"\n{'mode':<12}{'first request':>16}{'all ready':>12}{'PSS':>10}")
+    for mode, medians in summary.items():
+        print(f"{mode:<12}{medians['first_request'] * 1000:>13.0f} ms{medians['all_ready'] * 1000:>9.0f} ms"
+              f"{medians['pss'] / 2 ** 20:>7.0f} MB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'medians': summary}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+yt_dlp extractor plugin for the benchmark suite.
+
+Claims YouTube URLs whose IDs follow the synthetic scheme of benchmarks/media_server.py and
+reads their metadata from that server (BENCH_MEDIA_SERVER) instead of YouTube. yt_dlp loads
+it when the benchmarks/ directory is on sys.path; plugin extractors are tried before the
+built-in ones, and real YouTube IDs never match.
+"""
+import os
+
+from yt_dlp.extractor.common import InfoExtractor
+
+MEDIA_SERVER = os.environ.get('BENCH_MEDIA_SERVER', 'http://127.0.0.1:8765').rstrip('/')
+
+
+class BenchVideoIE(InfoExtractor):
+    IE_NAME = 'bench:video'
+    _VALID_URL = r'https?://(?:www\.)?(?:youtube\.com/(?:watch\?v=|shorts/)|youtu\.be/)(?P<id>b\d{5}[0-9a-z]{5})(?![\w-])(?!.*[?&]list=)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return self._download_json(f'{MEDIA_SERVER}/info/{video_id}', video_id)
+
+
+class BenchPlaylistIE(InfoExtractor):
+    IE_NAME = 'bench:playlist'
+    _VALID_URL = r'https?://(?:www\.)?youtube\.com/(?:playlist|watch)\?(?:[^#]*&)?list=(?P<id>bench-\d+-\d+-\d-[0-9a-z]{5})'
+
+    def _real_extract(self, url):
+        playlist_id = self._match_id(url)
+        data = self._download_json(f'{MEDIA_SERVER}/playlist/{playlist_id}', playlist_id)
+        entries = [
+            self.url_result(
+                f'https://www.youtube.com/watch?v={entry["id"]}', BenchVideoIE, entry['id'], entry['title'],
+                duration=entry['duration'])
+            for entry in data['entries']
+        ]
+        return self.playlist_result(entries, playlist_id, data['title'])
@@ -1,4 +1,73 @@
 SESSION_LIFETIME = 60*60  # 1h for testing
+# Sessions are signed cookies holding only the session ID. The signing key is SECRET_KEY from the
+# environment, else the contents of this file, created by the first process that needs it.
+SECRET_KEY_FILE = 'secret_key'
+
+# Expired session sweeping (one elected process, see utils.cleanup_expired_sessions)
+CLEANUP_BATCH_SIZE = 200  # downloads removed per sweep
+CLEANUP_LEASE_SECONDS = 30
+
+# Shared yt_dlp metadata cache (stored in downloads.db)
+METADATA_CACHE_TTL = 30*60  # seconds
+METADATA_CACHE_MAX_ENTRIES = 500
+
+# Content-addressed store of finished downloads shared across sessions
+OUTPUT_CACHE_DIR = 'output_cache'
+OUTPUT_CACHE_MAX_BYTES = 5 * 1024**3  # 5 GB
+
+# Disk budget for files under downloads/ (storage.py). Jobs reserve their estimated size when
+# admitted; completed files are evicted least recently downloaded first when a budget is exceeded.
+DISK_BUDGET_BYTES = 20 * 1024**3  # all sessions; jobs wait when nothing more can be evicted
+SESSION_QUOTA_BYTES = 2 * 1024**3  # per session; jobs over it are rejected
+STORAGE_DEFER_SECONDS = 60  # a job waiting for disk space is retried after this
+
+# Identical jobs submitted while one is running attach to it instead of downloading again
+INFLIGHT_JOB_TIMEOUT = 2*60*60  # seconds before a running job is no longer joined
+
+# Durable job queue (jobs table) served by worker.py
+JOB_LEASE_SECONDS = 60  # a job is re-enqueued if its worker stops renewing the lease
+JOB_MAX_ATTEMPTS = 3
+JOB_POLL_INTERVAL = 1  # seconds between claims when the queue is empty
+
+# Fair scheduling of queued jobs (jobs.claim_job)
+JOB_PRIORITIES = {'single_audio': 0, 'single_video': 1, 'playlist_audio': 2, 'playlist_video': 2}  # lower runs first
+JOB_PRIORITY_AGING = 5*60  # a waiting job moves up one priority class per this many seconds
+JOB_MAX_PER_SESSION = 2  # jobs of one session downloading or transcoding at once
+JOB_DEFAULT_DURATION = 5*60  # seconds of media assumed when the cost of a job cannot be estimated
+
+# SQLite access (db.py)
+DB_BUSY_TIMEOUT = 30  # seconds a connection waits for a lock held by another process
+DB_WRITE_FLUSH_INTERVAL = 1  # seconds between flushes of buffered progress/entry status writes
+
+# Metrics (/metrics) recorded in each process and summed across processes in the metrics table
+METRICS_FLUSH_INTERVAL = 10  # seconds between writes of a process's metrics
+METRICS_RETIRE_AFTER = 60*60  # counters of processes gone this long are folded into one row
+
+# Server-Sent Events status stream (/events)
+SSE_POLL_INTERVAL = 2  # seconds between checks for changed rows
+SSE_MAX_STREAMS = 2  # open streams per web worker process; further clients poll /session_status
+SSE_KEEPALIVE_INTERVAL = 15
+SSE_STREAM_DURATION = 5*60  # the browser reconnects after this
+SSE_RETRY_MS = 1000
+
+# AAC/OGG jobs pipe the audio stream into ffmpeg instead of writing it to disk first
+PIPE_HTTP_CHUNK_SIZE = 10 * 1024**2  # bytes per HTTP range request (formats without their own chunk size)
+
+# Sources already in the requested codec are stream-copied (transcode_plan.py) if their bitrate
+# is at most this fraction above the requested one
+PLAN_BITRATE_TOLERANCE = 0.25
+
+# Playlists are streamed to the client as a zip built on the fly; set to True to also write the zip to disk
+PLAYLIST_ZIP_ON_DISK = False
+
+# /download hands finished files to the front proxy instead of sending them from Python:
+# None, 'x-accel' (nginx X-Accel-Redirect) or 'x-sendfile' (Apache mod_xsendfile, lighttpd).
+# Streamed playlist zips are always sent by the app (see PLAYLIST_ZIP_ON_DISK).
+DOWNLOAD_OFFLOAD = None
+DOWNLOAD_ACCEL_PREFIX = '/protected-downloads/'  # nginx internal location aliased to downloads/
+
+# /trace_stats summarises the job stage spans (tracing.py) started within this many seconds
+TRACE_STATS_WINDOW = 24 * 60 * 60
 
 AUDIO_FORMATS = {
     'mp3': [64, 128, 192, 256, 320],
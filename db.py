@@ -0,0 +1,142 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from config import DB_BUSY_TIMEOUT, DB_WRITE_FLUSH_INTERVAL
+
+DB_PATH = 'downloads.db'
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+def get_connection():
+    """
+    Return this thread's connection to downloads.db, opening it on first use.
+    Connections are in autocommit mode; use transaction() to group statements.
+    SQLite caches prepared statements per connection, so reusing the connection reuses them.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        # A connection inherited across fork() must never be used by the child
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, isolation_level=None, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}')
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def close_connection():
+    """
+    Close this thread's connection, if open. A process that forks afterwards (the Gunicorn master
+    with preload_app) must not hold an open SQLite handle: the children would inherit it.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def execute(sql, params=()):
+    return get_connection().execute(sql, params)
+
+
+def executemany(sql, rows):
+    return get_connection().executemany(sql, rows)
+
+
+def query_one(sql, params=()):
+    return get_connection().execute(sql, params).fetchone()
+
+
+def query_all(sql, params=()):
+    return get_connection().execute(sql, params).fetchall()
+
+
+@contextmanager
+def transaction(immediate=False, timed=True):
+    """
+    Run the enclosed statements in one transaction. BEGIN IMMEDIATE takes the write lock up
+    front, which serializes read-then-write sequences across processes; the wait is recorded
+    in ytdl_db_lock_wait_seconds unless timed is False.
+    Nested use joins the outer transaction.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    if immediate:
+        started = time.monotonic()
+        conn.execute('BEGIN IMMEDIATE')
+        if timed:
+            metrics.observe('ytdl_db_lock_wait_seconds', time.monotonic() - started)
+    else:
+        conn.execute('BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+class WriteBuffer:
+    """
+    Coalesces frequent single-row UPDATEs (progress, playlist entry status) and writes them
+    in one transaction every DB_WRITE_FLUSH_INTERVAL seconds. Later values for the same row
+    and column replace earlier ones, so a burst of hook calls costs a single write.
+    """
+
+    def __init__(self, interval=DB_WRITE_FLUSH_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = {}  # (table, key columns, key values) -> {column: value}
+        self.pid = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent flushes its own pending updates; a lock held at fork() would never be released
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def update(self, table, key, values):
+        """Queue `UPDATE table SET values WHERE key` (key and values are dicts)."""
+        with self.lock:
+            row_key = (table, tuple(key), tuple(key.values()))
+            self.pending.setdefault(row_key, {}).update(values)
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        with transaction(immediate=True) as conn:
+            for (table, key_columns, key_values), values in pending.items():
+                conn.execute(
+                    f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in values)} "
+                    f"WHERE {' AND '.join(f'{column} = ?' for column in key_columns)}",
+                    list(values.values()) + list(key_values)
+                )
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush buffered database writes')
+
+
+write_buffer = WriteBuffer()
+atexit.register(write_buffer.flush)
@@ -0,0 +1,158 @@
+import hashlib
+import mimetypes
+import os
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response, request, stream_with_context
+from werkzeug.utils import wrap_file
+
+from config import DOWNLOAD_ACCEL_PREFIX, DOWNLOAD_OFFLOAD
+from metrics import inc, stage_timer
+from zipstream import MANIFEST_NAME, ZipStream
+
+DOWNLOADS_DIR = 'downloads'
+READ_SIZE = 1024 * 1024
+
+
+def count_served(chunks):
+    """Pass chunks through, counting the bytes actually sent and the time the stream took."""
+    with stage_timer('zip_stream'):
+        for chunk in chunks:
+            inc('ytdl_download_bytes_served_total', len(chunk))
+            yield chunk
+
+
+def _set_attachment(response, filename):
+    # As flask.send_file does: non-ASCII names go in filename* with an ASCII fallback
+    try:
+        filename.encode('ascii')
+        names = {'filename': filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+-.^_`|~')}"}
+    response.headers.set('Content-Disposition', 'attachment', **names)
+
+
+def _requested_range(size, etag, last_modified):
+    """
+    Return (start, stop) of the single byte range requested, None to send the whole body
+    (no Range header, several ranges, or an If-Range that no longer matches) or False if the
+    range cannot be satisfied.
+    """
+    if request.range is None or request.range.units != 'bytes' or len(request.range.ranges) != 1:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and int(last_modified) > if_range.date.timestamp():
+        return None
+    return request.range.range_for_length(size) or False
+
+
+def _conditional_response(size, etag, last_modified, read_range, mimetype, filename):
+    """
+    Build a download response with a strong ETag and Last-Modified, answering If-None-Match and
+    If-Modified-Since with 304 and a single Range with 206 (416 if unsatisfiable).
+    read_range(start, stop) returns the body iterable for those bytes.
+    """
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    _set_attachment(response, filename)
+    response.set_etag(etag)
+    response.last_modified = int(last_modified)
+    response.accept_ranges = 'bytes'
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = request.if_modified_since is not None and int(last_modified) <= request.if_modified_since.timestamp()
+    if not_modified:
+        response.status_code = 304
+        return response
+
+    byte_range = _requested_range(size, etag, last_modified)
+    if byte_range is False:
+        response.status_code = 416
+        response.content_range = f'bytes */{size}'
+        response.content_length = 0
+        return response
+    start, stop = byte_range or (0, size)
+    if byte_range:
+        response.status_code = 206
+        response.content_range = f'bytes {start}-{stop - 1}/{size}'
+    response.content_length = stop - start
+    response.response = read_range(start, stop)
+    return response
+
+
+def _read_file(path, start, stop, size):
+    f = open(path, 'rb')
+    f.seek(start)
+    if stop == size:
+        # Through the server's wsgi.file_wrapper, which gunicorn sends with os.sendfile
+        return wrap_file(request.environ, f, READ_SIZE)
+
+    def chunks():
+        with f:
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    return chunks()
+
+
+def _offload(path, filename, mimetype):
+    """
+    Response telling the front proxy to send path itself (DOWNLOAD_OFFLOAD), or None if it
+    cannot. The proxy then answers Range and conditional requests for the file.
+    """
+    relative_path = os.path.relpath(os.path.abspath(path), os.path.abspath(DOWNLOADS_DIR))
+    if DOWNLOAD_OFFLOAD == 'x-sendfile':
+        header = ('X-Sendfile', quote(os.path.abspath(path)))
+    elif DOWNLOAD_OFFLOAD == 'x-accel' and not relative_path.startswith(os.pardir):
+        header = ('X-Accel-Redirect', DOWNLOAD_ACCEL_PREFIX + quote(relative_path.replace(os.sep, '/')))
+    else:
+        return None
+    response = Response(mimetype=mimetype)
+    _set_attachment(response, filename)
+    response.headers[header[0]] = header[1]
+    return response
+
+
+def send_download(path):
+    """Send a finished file, or hand it to the front proxy when DOWNLOAD_OFFLOAD is set."""
+    filename = os.path.basename(path)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if DOWNLOAD_OFFLOAD:
+        response = _offload(path, filename, mimetype)
+        if response is not None:
+            return response
+    stat = os.stat(path)
+    # Finished files are never rewritten in place, so size and mtime identify their bytes
+    etag = f'{stat.st_size:x}-{stat.st_mtime_ns:x}'
+
+    def read_range(start, stop):
+        inc('ytdl_download_bytes_served_total', stop - start)
+        return _read_file(path, start, stop, stat.st_size)
+
+    return _conditional_response(stat.st_size, etag, stat.st_mtime, read_range, mimetype, filename)
+
+
+def stream_zip(directory):
+    """
+    Stream a playlist directory as a ZIP_STORED archive without writing it to disk. The layout is
+    fixed by the manifest, so ranges are generated directly and a resumed download continues where
+    it stopped.
+    """
+    archive = ZipStream(directory)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    with open(manifest_path, 'rb') as f:
+        etag = hashlib.sha256(f.read() + archive.filename.encode('utf-8')).hexdigest()[:32]
+
+    def read_range(start, stop):
+        return stream_with_context(count_served(archive.iter_chunks(start, stop)))
+
+    return _conditional_response(archive.size, etag, os.path.getmtime(manifest_path), read_range,
+                                 'application/zip', archive.filename)
@@ -0,0 +1,592 @@
+import datetime
+import logging
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import yt_dlp
+from yt_dlp.networking import Request
+from yt_dlp.utils import download_range_func, sanitize_filename
+
+from config import PIPE_HTTP_CHUNK_SIZE, PLAYLIST_ZIP_ON_DISK, RESOLUTIONS
+from db import execute, query_all, write_buffer
+from inflight import resolve_followers
+from jobs import load_checkpoint, remove_partial_files
+from metrics import stage_timer
+from metadata_cache import get_video_info, open_playlist, peek_cached_info
+from output_cache import store_output
+from progress import ProgressReporter, run_ffmpeg, update_status
+from storage import admit, estimate_output_size
+from tracing import propagate
+from transcode_plan import (AUDIO_CONTAINER_ARGS, AUDIO_COPY_FILE_CODECS, AUDIO_ENCODERS, plan_audio,
+                            plan_muted_video)
+from utils import get_playlist_concurrency
+from validations import (check_entry_duration, check_url_accessible, check_video_duration, is_playlist,
+                         time_to_seconds)
+from zipstream import ZipStream, write_zip_manifest
+
+logger = logging.getLogger(__name__)
+
+PIPE_BLOCK_SIZE = 64 * 1024
+
+def get_timestamp():
+    """Generate a timestamp for file naming."""
+    return datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+
+def finish_job(download_id, cache_key, file_path):
+    """Cache a finished file and hand it to any identical downloads attached to this job."""
+    try:
+        store_output(cache_key, file_path)
+    except Exception:
+        pass
+    resolve_followers(cache_key, download_id, 'Completed', file_path)
+
+def fail_job(download_id, cache_key, error):
+    """Record a failed job, remove its partial downloads and propagate the error to attached downloads."""
+    update_status(download_id, f'Error: {str(error)}')
+    try:
+        remove_partial_files(download_id)
+    except OSError:
+        logger.exception('Failed to remove partial files of job %s', download_id)
+    resolve_followers(cache_key, download_id, f'Error: {str(error)}')
+
+def start_job(download_id):
+    """Mark a claimed job as downloading and return its ProgressReporter, resuming from its checkpoint if any."""
+    update_status(download_id, 'Downloading')
+    checkpoint = load_checkpoint(download_id)
+    if checkpoint:
+        logger.info('Resuming job %s from stage %s', download_id, checkpoint.get('stage'))
+    reporter = ProgressReporter(download_id, checkpoint)
+    reporter.save_checkpoint(stage='download')
+    return reporter
+
+def validate_job(url, reporter, resolution=None):
+    """
+    Run the checks that need the network, which the web tier leaves to the worker:
+    URL accessibility and, for video, the 4K/2K duration limits. Raises with the user-facing message.
+    Playlist jobs are checked as they are listed instead (list_playlist, download_playlist_entries).
+    """
+    reporter.set_stage('Validating')
+    is_valid, error = check_url_accessible(url)
+    if is_valid and resolution:
+        is_valid, error = check_video_duration(url, resolution)
+    if not is_valid:
+        raise Exception(error)
+
+def admit_job(download_id, payload):
+    """Validate a job, then check the disk budget with its full metadata. Returns 'ok', 'defer' or 'reject'."""
+    url = payload['url']
+    if is_playlist(url):
+        info = peek_cached_info(url)  # Playlists are not listed just for the estimate
+    else:
+        try:
+            validate_job(url, ProgressReporter(download_id), payload.get('resolution'))
+        except Exception as e:
+            fail_job(download_id, payload['cache_key'], e)
+            return 'reject'
+        info = get_video_info(url)  # Cached by validate_job
+    estimate = estimate_output_size(
+        info, payload['format_type'], payload.get('bitrate') or payload.get('resolution'),
+        payload.get('start_time', ''), payload.get('end_time', ''), payload.get('mute', False)
+    )
+    decision, message = admit(download_id, payload['session_id'], estimate)
+    if decision == 'reject':
+        fail_job(download_id, payload['cache_key'], message)
+    elif decision == 'defer':
+        ProgressReporter(download_id).set_stage(message)
+    return decision
+
+def record_plan(download_id, description):
+    """Store the transcode path taken for a download."""
+    execute('UPDATE downloads SET transcode_plan = ? WHERE download_id = ?', (description, download_id))
+
+def get_clip_duration(duration, start_time, end_time):
+    """Length in seconds of the trimmed part of a media file, or None if unknown."""
+    end = time_to_seconds(end_time) if end_time else duration
+    if end is None:
+        return None
+    return max(0, end - (time_to_seconds(start_time) if start_time else 0))
+
+def get_trim_options(start_time, end_time):
+    """
+    yt_dlp options that fetch only the trimmed part of a video ({} when not trimmed).
+    yt_dlp then downloads through ffmpeg with -ss before -i, which seeks the remote input
+    with range requests instead of fetching and decoding everything before the start.
+    """
+    if not start_time and not end_time:
+        return {}
+    start = time_to_seconds(start_time) if start_time else 0
+    end = time_to_seconds(end_time) if end_time else float('inf')
+    return {'download_ranges': download_range_func(None, [(start, end)])}
+
+def get_entry_url(entry):
+    """Return a downloadable URL for a flat playlist entry."""
+    entry_url = entry.get('url') or ''
+    if entry_url.startswith('http'):
+        return entry_url
+    return f"https://www.youtube.com/watch?v={entry['id']}"
+
+def update_entry_status(download_id, entry_index, status, file_path=None):
+    """Queue a status update for a single playlist entry (written by the next buffer flush)."""
+    write_buffer.update(
+        'playlist_entries',
+        {'download_id': download_id, 'entry_index': entry_index},
+        {'status': status, 'file_path': file_path}
+    )
+
+def download_playlist_entry(download_id, entry_index, entry, ydl_opts, output_ext, reporter, done_status='Completed'):
+    """
+    Download one playlist entry. Returns the output path, or None if the entry failed.
+    With output_ext None the downloaded file is returned as is (before any conversion).
+    """
+    update_entry_status(download_id, entry_index, 'Downloading')
+    try:
+        with yt_dlp.YoutubeDL(dict(ydl_opts, **reporter.ydl_hooks())) as ydl, stage_timer('download'):
+            info = ydl.extract_info(get_entry_url(entry), download=True)
+            file_path = ydl.prepare_filename(info)
+            if output_ext:
+                file_path = os.path.splitext(file_path)[0] + output_ext
+        if not os.path.exists(file_path):
+            raise Exception(f"File not found: {file_path}")
+        update_entry_status(download_id, entry_index, done_status, file_path)
+        return file_path
+    except Exception as e:
+        update_entry_status(download_id, entry_index, f'Error: {str(e)}')
+        return None
+    finally:
+        reporter.entry_finished()
+
+def list_playlist(url, reporter):
+    """
+    Start listing a playlist (metadata_cache.open_playlist). Returns (playlist_info, entries)
+    where entries fetches further pages of the listing as it is consumed.
+    """
+    reporter.set_stage('Listing')
+    try:
+        playlist_info, entries = open_playlist(url)
+    except Exception as e:
+        raise Exception(f"Invalid URL: {str(e)}")
+    if not playlist_info:
+        raise Exception("Could not retrieve playlist information")
+    reporter.set_entry_count(playlist_info.get('playlist_count'))
+    return playlist_info, entries
+
+def get_finished_entries(download_id, statuses):
+    """
+    Return {entry_index: (video_id, path)} for the playlist entries of an interrupted job that
+    reached one of statuses and whose file is still there.
+    """
+    rows = query_all(
+        f"SELECT entry_index, video_id, file_path FROM playlist_entries WHERE download_id = ? "
+        f"AND status IN ({', '.join('?' * len(statuses))})",
+        (download_id, *statuses)
+    )
+    return {
+        entry_index: (video_id, file_path) for entry_index, video_id, file_path in rows
+        if file_path and os.path.exists(file_path)
+    }
+
+def unique_entries(entries):
+    """Yield the listed entries with an id, skipping repeats of a video already yielded."""
+    seen = set()
+    for entry in entries:
+        if entry and entry.get('id') and entry['id'] not in seen:
+            seen.add(entry['id'])
+            yield entry
+
+def download_playlist_entries(download_id, entries, ydl_opts, output_ext, reporter, done_status='Completed',
+                              resume=False, resolution=None):
+    """Download playlist entries in parallel as they are listed. Returns {entry_index: path} of those that succeeded."""
+    finished = get_finished_entries(download_id, (done_status, 'Converting', 'Completed')) if resume else {}
+    file_paths, futures = {}, {}
+    with ThreadPoolExecutor(max_workers=get_playlist_concurrency()) as pool:
+        try:
+            for entry_index, entry in enumerate(unique_entries(entries)):
+                reporter.entry_listed(entry_index + 1)
+                is_valid, error = check_entry_duration(entry, resolution)
+                if not is_valid:
+                    raise Exception(error)
+                video_id, file_path = finished.get(entry_index, (None, None))
+                if video_id == entry['id']:
+                    file_paths[entry_index] = file_path
+                    reporter.entry_finished()
+                    continue
+                execute(
+                    'INSERT OR REPLACE INTO playlist_entries (download_id, entry_index, video_id, title, status) VALUES (?, ?, ?, ?, ?)',
+                    (download_id, entry_index, entry['id'], entry.get('title'), 'Pending')
+                )
+                futures[entry_index] = pool.submit(
+                    propagate(download_playlist_entry), download_id, entry_index, entry, ydl_opts, output_ext, reporter, done_status
+                )
+        except Exception:
+            for entry_index, future in futures.items():
+                if future.cancel():
+                    update_entry_status(download_id, entry_index, 'Skipped')
+            raise
+
+    file_paths.update((entry_index, future.result()) for entry_index, future in futures.items() if future.result())
+    if not file_paths:
+        raise Exception("None of the playlist entries could be downloaded")
+    return dict(sorted(file_paths.items()))
+
+def probe_audio_codec(file_path):
+    """ffprobe's name for the codec of a file's first audio stream, or None."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name',
+         '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+def extract_audio(file_path, format_type, bitrate, reporter=None, duration=None):
+    """Convert a downloaded file to format_type next to it through run_ffmpeg and remove the source. Returns the output path."""
+    output_path = f'{os.path.splitext(file_path)[0]}.{format_type}'
+    copy = probe_audio_codec(file_path) in AUDIO_COPY_FILE_CODECS[format_type]
+    if copy and output_path == file_path:
+        return file_path
+    codec_args = ['-c:a', 'copy'] if copy else ['-c:a', AUDIO_ENCODERS[format_type], '-b:a', f'{bitrate}k']
+    # Re-encoding a file in place goes through a temporary name
+    target = output_path if output_path != file_path else f'{os.path.splitext(file_path)[0]}.temp.{format_type}'
+    run_ffmpeg(['ffmpeg', '-y', '-i', file_path, '-vn'] + codec_args + AUDIO_CONTAINER_ARGS.get(format_type, []) + [target],
+               reporter, duration)
+    os.replace(target, output_path)
+    if output_path != file_path:
+        os.remove(file_path)
+    return output_path
+
+def convert_playlist_entry(download_id, entry_index, file_path, format_type, bitrate):
+    """Convert a downloaded playlist entry to format_type. Returns the output path, or None on failure."""
+    update_entry_status(download_id, entry_index, 'Converting', file_path)
+    try:
+        output_path = extract_audio(file_path, format_type, bitrate)
+        update_entry_status(download_id, entry_index, 'Completed', output_path)
+        return output_path
+    except subprocess.CalledProcessError as e:
+        update_entry_status(download_id, entry_index, f'Error: FFmpeg failed - {e.stderr}')
+        return None
+    except Exception as e:
+        update_entry_status(download_id, entry_index, f'Error: {str(e)}')
+        return None
+
+def finalize_playlist(playlist_dir, file_paths, reporter):
+    """
+    Write the zip manifest for a finished playlist and return the path to serve.
+    By default /download streams the zip straight from playlist_dir; with
+    PLAYLIST_ZIP_ON_DISK the archive is also written next to it.
+    """
+    reporter.set_stage('Packaging')
+    with stage_timer('zip') as span:
+        span.bytes = sum(os.path.getsize(path) for path in file_paths)
+        write_zip_manifest(playlist_dir, file_paths)
+        if not PLAYLIST_ZIP_ON_DISK:
+            return playlist_dir
+        zip_path = f"{os.path.normpath(playlist_dir)}.zip"
+        ZipStream(playlist_dir).write_to(zip_path)
+    return zip_path
+
+def handle_single_audio_download(download_id, session_id, url, format_type, bitrate, start_time, end_time, user_dir, cache_key):
+    """Handle downloading a single audio file."""
+    reporter = start_job(download_id)
+    try:
+        if format_type == 'aac':
+            file_path = yield from handle_aac_download(download_id, url, bitrate, start_time, end_time, user_dir, reporter)
+        elif format_type == 'ogg':
+            file_path = yield from handle_ogg_download(download_id, url, bitrate, start_time, end_time, user_dir, reporter)
+        else:
+            file_path = yield from handle_standard_audio_download(download_id, url, format_type, bitrate, start_time, end_time, user_dir, reporter)
+        finish_job(download_id, cache_key, file_path)
+    except Exception as e:
+        fail_job(download_id, cache_key, e)
+        raise
+
+def iter_format_bytes(ydl, fmt, reporter):
+    """
+    Yield the bytes of a direct HTTP format in PIPE_BLOCK_SIZE blocks.
+    Known-size formats are fetched in http_chunk_size Range requests, as yt_dlp does, since
+    YouTube throttles long single requests.
+    """
+    total = fmt.get('filesize')
+    chunk_size = (fmt.get('downloader_options') or {}).get('http_chunk_size') or PIPE_HTTP_CHUNK_SIZE
+    position = 0
+    while True:
+        headers = dict(fmt.get('http_headers') or {})
+        if total:
+            headers['Range'] = f'bytes={position}-{min(position + chunk_size, total) - 1}'
+        response = ydl.urlopen(Request(fmt['url'], headers=headers))
+        received = 0
+        try:
+            for block in iter(lambda: response.read(PIPE_BLOCK_SIZE), b''):
+                received += len(block)
+                reporter.source_progress(position + received, total)
+                yield block
+        finally:
+            response.close()
+        position += received
+        if not total or position >= total:
+            return
+        if not received:
+            raise Exception(f"Download stopped at byte {position} of {total}")
+
+def transcode_audio(url, start_time, end_time, download_path, output_path, plan, copy_args, encode_args, reporter):
+    """Write the audio stream chosen by plan to output_path, piped or as a yielded transcode step. Returns the path taken."""
+    ydl_opts = {
+        'format': plan['format'],
+        'outtmpl': download_path,
+        'quiet': True,
+        **get_trim_options(start_time, end_time),
+        **reporter.ydl_hooks(),
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with stage_timer('extract_info'):
+            info = ydl.extract_info(url, download=False)
+        duration = get_clip_duration(info.get('duration'), start_time, end_time)
+        copy = plan['action'] == 'copy' and info.get('format_id') == plan['format_id']
+        codec_args = copy_args if copy else encode_args
+        if copy and not start_time and not end_time and info.get('url') and info.get('protocol') in ('http', 'https'):
+            run_ffmpeg(['ffmpeg', '-y', '-i', 'pipe:0'] + codec_args + [output_path], reporter, duration,
+                       stage='Transcoding', input_chunks=iter_format_bytes(ydl, info, reporter))
+            return 'copy'
+
+        try:
+            with stage_timer('download'):
+                ydl.process_ie_result(info, download=True)
+
+            def convert():
+                # The download already covers only the trimmed range
+                run_ffmpeg(['ffmpeg', '-y', '-i', download_path] + codec_args + [output_path], reporter, duration)
+
+            if copy:
+                convert()
+            else:
+                reporter.set_stage('Queued')
+                reporter.save_checkpoint(stage='transcode')
+                yield [convert]
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+    return 'copy' if copy else 'encode'
+
+def handle_aac_download(download_id, url, bitrate, start_time, end_time, user_dir, reporter):
+    """Handle AAC audio download with FFmpeg conversion."""
+    try:
+        info = get_video_info(url)
+        safe_title = sanitize_filename(info['title'])
+        
+        download_path = os.path.join(user_dir, f'{safe_title}.webm')
+        aac_path = os.path.join(user_dir, f'{safe_title}.aac')
+
+        plan = plan_audio(info, 'aac', bitrate, 'bestaudio[ext=webm]/bestaudio')
+        action = yield from transcode_audio(url, start_time, end_time, download_path, aac_path, plan,
+                                 ['-c:a', 'copy', '-f', 'adts'],
+                                 ['-c:a', 'aac', '-b:a', bitrate + 'k', '-f', 'adts'], reporter)
+        record_plan(download_id, plan['description'] if action == plan['action'] else f'{action} (fallback)')
+
+        if not os.path.exists(aac_path):
+            raise Exception(f"Conversion failed: {aac_path} not found")
+
+        update_status(download_id, 'Completed', aac_path)
+        return aac_path
+
+    except subprocess.CalledProcessError as e:
+        update_status(download_id, f'Error: FFmpeg failed - {e.stderr}')
+        raise
+    except Exception as e:
+        update_status(download_id, f'Error: {str(e)}')
+        raise
+
+def handle_ogg_download(download_id, url, bitrate, start_time, end_time, user_dir, reporter):
+    """Handle OGG audio download with FFmpeg conversion."""
+    try:
+        info = get_video_info(url)
+        safe_title = sanitize_filename(info['title'])
+        
+        download_path = os.path.join(user_dir, f'{safe_title}.webm')
+        ogg_path = os.path.join(user_dir, f'{safe_title}.ogg')
+
+        plan = plan_audio(info, 'ogg', bitrate, 'bestaudio[ext=webm]/bestaudio')
+        action = yield from transcode_audio(url, start_time, end_time, download_path, ogg_path, plan,
+                                 ['-c:a', 'copy'],
+                                 ['-c:a', 'libvorbis', '-b:a', bitrate + 'k'], reporter)
+        record_plan(download_id, plan['description'] if action == plan['action'] else f'{action} (fallback)')
+
+        if not os.path.exists(ogg_path):
+            raise Exception(f"Conversion failed: {ogg_path} not found")
+
+        update_status(download_id, 'Completed', ogg_path)
+        return ogg_path
+        
+    except subprocess.CalledProcessError as e:
+        update_status(download_id, f'Error: FFmpeg failed - {e.stderr}')
+        raise
+    except Exception as e:
+        update_status(download_id, f'Error: {str(e)}')
+        raise
+
+def handle_standard_audio_download(download_id, url, format_type, bitrate, start_time, end_time, user_dir, reporter):
+    """
+    Handle standard audio download (mp3, m4a).
+    extract_audio stream-copies when the downloaded source already has the target codec;
+    otherwise the conversion is yielded as a transcode step.
+    """
+    try:
+        plan = plan_audio(get_video_info(url), format_type, bitrate)
+        record_plan(download_id, plan['description'])
+        ydl_opts = {
+            'format': plan['format'],
+            'outtmpl': os.path.join(user_dir, '%(title)s.%(ext)s'),
+            **get_trim_options(start_time, end_time),
+            **reporter.ydl_hooks(),
+        }
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with stage_timer('download'):
+                info = ydl.extract_info(url, download=True)
+            duration = get_clip_duration(info.get('duration'), start_time, end_time)
+
+            def convert():
+                return extract_audio(info['requested_downloads'][0]['filepath'], format_type, bitrate, reporter, duration)
+
+            if plan['action'] == 'copy':
+                filename = convert()
+            else:
+                reporter.set_stage('Queued')
+                reporter.save_checkpoint(stage='transcode')
+                [filename] = yield [convert]
+            if not os.path.exists(filename):
+                raise Exception(f"File not found: {filename}")
+        
+        update_status(download_id, 'Completed', filename)
+        return filename
+    except Exception as e:
+        update_status(download_id, f'Error: {str(e)}')
+        raise
+
+def handle_playlist_download(download_id, session_id, url, format_type, bitrate, user_dir, cache_key):
+    """Handle downloading an audio playlist. Entries are converted and packaged in the transcode stage."""
+
+    reporter = start_job(download_id)
+    try:
+        playlist_info, entries = list_playlist(url, reporter)
+        playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_info.get('title') or 'playlist')
+
+        # A resumed job continues in the directory it started, where its entries are
+        resume = 'playlist_dir' in reporter.checkpoint
+        playlist_dir = reporter.checkpoint.get('playlist_dir') or os.path.join(user_dir, f"{playlist_title}_{get_timestamp()}")
+        os.makedirs(playlist_dir, exist_ok=True)
+        reporter.save_checkpoint(playlist_dir=playlist_dir)
+
+        ydl_opts = {
+            'format': 'bestaudio',
+            'outtmpl': f'{playlist_dir}/%(title)s [%(id)s].%(ext)s',
+        }
+        downloaded = download_playlist_entries(download_id, entries, ydl_opts, None, reporter, 'Downloaded', resume)
+        # Entries of a resumed job that were converted before come back with their output path
+        converted = {
+            entry_index: file_path for entry_index, (_, file_path) in get_finished_entries(download_id, ('Completed',)).items()
+            if downloaded.get(entry_index) == file_path
+        } if resume else {}
+        to_convert = [(entry_index, file_path) for entry_index, file_path in downloaded.items() if entry_index not in converted]
+
+        reporter.set_stage('Converting')
+        reporter.save_checkpoint(stage='transcode')
+        results = yield [
+            partial(convert_playlist_entry, download_id, entry_index, file_path, format_type, bitrate)
+            for entry_index, file_path in to_convert
+        ]
+        converted.update((entry_index, file_path) for (entry_index, _), file_path in zip(to_convert, results) if file_path)
+        file_paths = [file_path for _, file_path in sorted(converted.items())]
+        if not file_paths:
+            raise Exception("None of the playlist entries could be converted")
+        reporter.save_checkpoint(stage='package')
+        output_path = finalize_playlist(playlist_dir, file_paths, reporter)
+
+        update_status(download_id, 'Completed', output_path)
+        finish_job(download_id, cache_key, output_path)
+    except Exception as e:
+        fail_job(download_id, cache_key, e)
+        raise
+
+def handle_single_video_download(download_id, session_id, url, format_type, resolution, mute, user_dir, cache_key):
+    """Handle downloading a single video file."""
+
+    reporter = start_job(download_id)
+    try:
+        video_format = f'bestvideo[height<={RESOLUTIONS[resolution]}]+bestaudio/best[height<={RESOLUTIONS[resolution]}]'
+        if mute:
+            # Prefer a stream already in the output container so the remux is a no-op
+            plan = plan_muted_video(get_video_info(url), format_type, resolution)
+            record_plan(download_id, plan['description'])
+            video_format = plan['format']
+        ydl_opts = {
+            'format': video_format,
+            'merge_output_format': format_type,
+            'outtmpl': os.path.join(user_dir, '%(title)s.%(ext)s'),
+            **reporter.ydl_hooks(),
+        }
+        if mute:
+            ydl_opts['postprocessors'] = [{
+                'key': 'FFmpegVideoRemuxer',
+                'preferedformat': format_type,
+            }]
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with stage_timer('download'):
+                info = ydl.extract_info(url, download=True)
+            filename = ydl.prepare_filename(info)
+            if mute:
+                filename = os.path.splitext(filename)[0] + f'.{format_type}'
+            if not os.path.exists(filename):
+                raise Exception(f"File not found: {filename}")
+        
+        update_status(download_id, 'Completed', filename)
+        finish_job(download_id, cache_key, filename)
+    except Exception as e:
+        fail_job(download_id, cache_key, e)
+        raise
+
+def handle_playlist_video_download(download_id, session_id, url, format_type, resolution, mute, user_dir, cache_key):
+    """Handle downloading a video playlist."""
+    reporter = start_job(download_id)
+    try:
+        playlist_info, entries = list_playlist(url, reporter)
+        playlist_title = re.sub(r'[^\w\-_\. ]', '_', playlist_info.get('title') or 'playlist')
+
+        # A resumed job continues in the directory it started, where its entries are
+        resume = 'playlist_dir' in reporter.checkpoint
+        playlist_dir = reporter.checkpoint.get('playlist_dir') or os.path.join(user_dir, f"{playlist_title}_{get_timestamp()}")
+        os.makedirs(playlist_dir, exist_ok=True)
+        reporter.save_checkpoint(playlist_dir=playlist_dir)
+
+        ydl_opts = {
+            'format': f'bestvideo[height<={RESOLUTIONS[resolution]}]+bestaudio/best[height<={RESOLUTIONS[resolution]}]' if not mute else f'bestvideo[height<={RESOLUTIONS[resolution]}]',
+            'merge_output_format': format_type,
+            'outtmpl': f'{playlist_dir}/%(title)s [%(id)s].%(ext)s',
+        }
+        if mute:
+            ydl_opts['postprocessors'] = [{
+                'key': 'FFmpegVideoRemuxer',
+                'preferedformat': format_type,
+            }]
+        file_paths = download_playlist_entries(download_id, entries, ydl_opts, f'.{format_type}', reporter,
+                                               resume=resume, resolution=resolution)
+        # Merging and remuxing are stream copies done while downloading; only packaging is CPU-bound
+        reporter.set_stage('Queued')
+        reporter.save_checkpoint(stage='package')
+        [output_path] = yield [partial(finalize_playlist, playlist_dir, list(file_paths.values()), reporter)]
+
+        update_status(download_id, 'Completed', output_path)
+        finish_job(download_id, cache_key, output_path)
+    except Exception as e:
+        fail_job(download_id, cache_key, e)
+        raise
+
+# Job types stored in the jobs table, mapped to the function that runs them
+JOB_HANDLERS = {
+    'single_audio': handle_single_audio_download,
+    'playlist_audio': handle_playlist_download,
+    'single_video': handle_single_video_download,
+    'playlist_video': handle_playlist_video_download,
+}
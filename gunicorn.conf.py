@@ -0,0 +1,18 @@
+# Gunicorn settings for the web app: gunicorn -c gunicorn.conf.py app:app
+# Command line options override these.
+import os
+
+bind = '0.0.0.0:5000'
+workers = 4
+worker_class = 'gthread'
+threads = 8
+
+# The master imports app.py (and creates the tables) once and forks the workers from it, so they
+# start without importing anything and share the imported modules' memory. Set WEB_PRELOAD=0 to
+# import the app in each worker instead, e.g. to pick up code changes with a HUP.
+preload_app = os.environ.get('WEB_PRELOAD', '1') != '0'
+
+
+def post_worker_init(worker):
+    # Marks the point a worker can serve requests (benchmarks/startup_test.py waits for it)
+    worker.log.info('Worker ready (pid: %s)', worker.pid)
@@ -0,0 +1,61 @@
+import os
+import time
+
+from config import INFLIGHT_JOB_TIMEOUT
+from db import executemany, transaction
+from output_cache import link_artifact
+from storage import artifact_size
+
+
+def join_or_lead(cache_key, download_id):
+    """
+    Register download_id as the running job for cache_key, or attach it to the job already running.
+    Returns the leader's download_id when attached, otherwise None (the caller must run the job).
+    """
+    now = time.time()
+    # BEGIN IMMEDIATE serializes the check-and-claim across gunicorn workers
+    with transaction(immediate=True) as conn:
+        row = conn.execute(
+            'SELECT i.leader_id, i.created_at, d.status FROM inflight_jobs i '
+            'LEFT JOIN downloads d ON d.download_id = i.leader_id WHERE i.cache_key = ?',
+            (cache_key,)
+        ).fetchone()
+        if row and row[2] and now - row[1] < INFLIGHT_JOB_TIMEOUT \
+                and row[2] != 'Completed' and not row[2].startswith('Error'):
+            conn.execute('UPDATE downloads SET leader_id = ? WHERE download_id = ?', (row[0], download_id))
+            return row[0]
+        conn.execute(
+            'INSERT OR REPLACE INTO inflight_jobs (cache_key, leader_id, created_at) VALUES (?, ?, ?)',
+            (cache_key, download_id, now)
+        )
+        return None
+
+
+def resolve_followers(cache_key, leader_id, status, file_path=None):
+    """Release cache_key and give every attached download the leader's result."""
+    with transaction(immediate=True) as conn:
+        conn.execute('DELETE FROM inflight_jobs WHERE cache_key = ? AND leader_id = ?', (cache_key, leader_id))
+        followers = conn.execute(
+            'SELECT download_id, session_id FROM downloads WHERE leader_id = ?', (leader_id,)
+        ).fetchall()
+
+    results = []
+    for follower_id, session_id in followers:
+        follower_status, follower_path = status, None
+        if file_path:
+            try:
+                user_dir = os.path.join('downloads', session_id)
+                os.makedirs(user_dir, exist_ok=True)
+                follower_path = link_artifact(
+                    file_path, os.path.join(user_dir, os.path.basename(file_path)), follower_id
+                )
+            except OSError as e:
+                follower_status = f'Error: {str(e)}'
+        results.append((follower_status, follower_path, artifact_size(follower_path) if follower_path else 0, follower_id))
+
+    if results:
+        with transaction():
+            executemany(
+                'UPDATE downloads SET status = ?, file_path = ?, size = ?, leader_id = NULL WHERE download_id = ?',
+                results
+            )
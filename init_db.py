@@ -1,10 +1,16 @@
 # SQLite database
-import sqlite3
+from db import transaction
 
-DB_PATH = 'downloads.db'
+def add_column_if_missing(conn, table, column, declaration):
+    """Add a column to an existing table (databases created before the column existed)."""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
 
 def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
+    # Not timed: recording a metric would start the metrics flush thread, and init_db runs in
+    # processes that fork afterwards (the Gunicorn master, worker.py)
+    with transaction(immediate=True, timed=False) as conn:
         conn.execute('''
             CREATE TABLE IF NOT EXISTS downloads (
                 download_id TEXT PRIMARY KEY,
@@ -14,11 +20,147 @@ def init_db():
                 format_type TEXT,
                 bitrate_or_res TEXT,
                 file_path TEXT,
-                created_at TIMESTAMP
+                created_at TIMESTAMP,
+                leader_id TEXT
+            )
+        ''')
+        add_column_if_missing(conn, 'downloads', 'leader_id', 'TEXT')
+        # Structured progress written by progress.ProgressReporter
+        for column, declaration in [
+            ('stage', 'TEXT'), ('bytes_downloaded', 'INTEGER'), ('total_bytes', 'INTEGER'),
+            ('speed', 'REAL'), ('eta', 'INTEGER'), ('percent', 'REAL'),
+            ('entry_index', 'INTEGER'), ('entry_count', 'INTEGER'), ('progress_updated_at', 'REAL'),
+        ]:
+            add_column_if_missing(conn, 'downloads', column, declaration)
+        # Source stream and copy/encode decision taken by transcode_plan.py
+        add_column_if_missing(conn, 'downloads', 'transcode_plan', 'TEXT')
+        # Disk budget (storage.py): bytes used or reserved, and when the file was last downloaded
+        add_column_if_missing(conn, 'downloads', 'size', 'INTEGER')
+        add_column_if_missing(conn, 'downloads', 'last_accessed', 'REAL')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_leader_id ON downloads (leader_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_session_id ON downloads (session_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_downloads_created_at ON downloads (created_at)')
+        # Sessions seen by the app (utils.touch_session); the ID itself lives in the signed cookie
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_seen REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON sessions (last_seen)')
+        # Stage timeline of each job and its profiled stacks (tracing.py), removed with the download
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS job_spans (
+                download_id TEXT,
+                stage TEXT,
+                started_at REAL,
+                duration REAL,
+                bytes INTEGER,
+                cpu_seconds REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_job_spans_download_id ON job_spans (download_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_job_spans_started_at ON job_spans (started_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS job_profile_samples (
+                download_id TEXT,
+                stack TEXT,
+                samples INTEGER,
+                PRIMARY KEY (download_id, stack)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metadata_cache (
+                cache_key TEXT PRIMARY KEY,
+                info BLOB,
+                fetched_at REAL,
+                last_accessed REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_metadata_cache_last_accessed ON metadata_cache (last_accessed)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metadata_cache_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS output_cache (
+                cache_key TEXT PRIMARY KEY,
+                path TEXT,
+                size INTEGER,
+                last_used REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_output_cache_last_used ON output_cache (last_used)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS inflight_jobs (
+                cache_key TEXT PRIMARY KEY,
+                leader_id TEXT,
+                created_at REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                download_id TEXT PRIMARY KEY,
+                job_type TEXT,
+                payload TEXT,
+                state TEXT,
+                attempts INTEGER,
+                worker_id TEXT,
+                lease_expires REAL,
+                created_at REAL,
+                updated_at REAL
+            )
+        ''')
+        # Jobs waiting for disk space are not claimed before not_before
+        add_column_if_missing(conn, 'jobs', 'not_before', 'REAL')
+        # Fair scheduling (jobs.claim_job): owning session, priority class and estimated cost
+        for column, declaration in [('session_id', 'TEXT'), ('priority', 'INTEGER'), ('cost', 'REAL')]:
+            add_column_if_missing(conn, 'jobs', column, declaration)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_session_id_state ON jobs (session_id, state)')
+        # Resume state of interrupted jobs (progress.ProgressReporter.save_checkpoint), as JSON
+        add_column_if_missing(conn, 'jobs', 'checkpoint', 'TEXT')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS job_sessions (
+                session_id TEXT PRIMARY KEY,
+                virtual_time REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state_created_at ON jobs (state, created_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS playlist_entries (
+                download_id TEXT,
+                entry_index INTEGER,
+                video_id TEXT,
+                title TEXT,
+                status TEXT,
+                file_path TEXT,
+                PRIMARY KEY (download_id, entry_index)
+            )
+        ''')
+        # Per-process metrics written by metrics.Registry
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics (
+                process_id TEXT,
+                name TEXT,
+                labels TEXT,
+                value REAL,
+                PRIMARY KEY (process_id, name, labels)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics_processes (
+                process_id TEXT PRIMARY KEY,
+                updated_at REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL
             )
         ''')
-        conn.commit()
-
-init_db()
 
     
\ No newline at end of file
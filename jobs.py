@@ -0,0 +1,262 @@
+import json
+import os
+import time
+
+from config import (JOB_DEFAULT_DURATION, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_MAX_PER_SESSION,
+                    JOB_PRIORITIES, JOB_PRIORITY_AGING, RESOLUTIONS)
+from db import execute, executemany, query_all, query_one, transaction
+from storage import get_media_duration
+
+# Effective priority class of a queued job (alias j): its class, raised one step per JOB_PRIORITY_AGING
+# seconds of waiting so playlists are delayed but never starved
+EFFECTIVE_PRIORITY = 'MAX(0, COALESCE(j.priority, 1) - CAST((? - j.created_at) / ? AS INTEGER))'
+
+
+def estimate_job_cost(info, job_type, bitrate_or_res, start_time='', end_time=''):
+    """
+    Relative cost of a job for fair scheduling: seconds of media, weighted by resolution for video
+    (360p = 1, 1080p = 3, 4K = 6). JOB_DEFAULT_DURATION seconds (per entry for playlists) are
+    assumed when the metadata is not known yet.
+    """
+    duration = get_media_duration(info, start_time, end_time) if info else 0
+    if not duration:
+        entries = len((info or {}).get('entries') or []) or 1
+        duration = JOB_DEFAULT_DURATION * (entries if job_type.startswith('playlist') else 1)
+    if job_type.endswith('video'):
+        return duration * int(RESOLUTIONS.get(bitrate_or_res, 360)) / 360
+    return duration
+
+
+def enqueue_job(download_id, job_type, payload, cost=None):
+    """Persist a job for the worker processes; the web tier never runs downloads itself."""
+    now = time.time()
+    session_id = payload.get('session_id')
+    with transaction(immediate=True) as conn:
+        conn.execute(
+            'INSERT INTO jobs (download_id, job_type, payload, state, attempts, session_id, priority, cost, '
+            'created_at, updated_at) VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?)',
+            (download_id, job_type, json.dumps(payload), 'queued', session_id, JOB_PRIORITIES.get(job_type, 1),
+             cost if cost is not None else estimate_job_cost(None, job_type, payload.get('resolution')), now, now)
+        )
+        # A session that was idle starts at the lowest virtual time of the busy sessions, so it
+        # neither jumps ahead of them with credit saved while idle nor waits behind their backlog
+        conn.execute(
+            'INSERT INTO job_sessions (session_id, virtual_time) VALUES (?, ('
+            '  SELECT COALESCE(MIN(s.virtual_time), 0) FROM job_sessions s WHERE s.session_id IN ('
+            "    SELECT session_id FROM jobs WHERE state IN ('queued', 'running', 'transcoding') AND session_id != ?))) "
+            'ON CONFLICT(session_id) DO UPDATE SET virtual_time = MAX(virtual_time, excluded.virtual_time)',
+            (session_id, session_id)
+        )
+
+
+def _requeue_expired(conn, now):
+    """Return jobs whose lease expired (crashed or restarted worker) to the queue."""
+    expired = conn.execute(
+        "SELECT download_id, attempts FROM jobs WHERE state IN ('running', 'transcoding') AND lease_expires < ?",
+        (now,)
+    ).fetchall()
+    for download_id, attempts in expired:
+        if attempts >= JOB_MAX_ATTEMPTS:
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', worker_id = NULL, updated_at = ? WHERE download_id = ?",
+                (now, download_id)
+            )
+            # As fail_job: release the size reservation, pass the error on to the downloads attached
+            # to this job (inflight.resolve_followers) and stop new ones from joining it
+            error = 'Error: Job abandoned after repeated worker failures'
+            conn.execute(
+                'UPDATE downloads SET status = ?, size = 0 WHERE download_id = ?',
+                (error, download_id)
+            )
+            conn.execute(
+                'UPDATE downloads SET status = ?, size = 0, leader_id = NULL WHERE leader_id = ?',
+                (error, download_id)
+            )
+            conn.execute('DELETE FROM inflight_jobs WHERE leader_id = ?', (download_id,))
+        else:
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', worker_id = NULL, updated_at = ? WHERE download_id = ?",
+                (now, download_id)
+            )
+            _mark_resuming(conn, download_id)
+    return len(expired)
+
+
+def _mark_resuming(conn, download_id):
+    conn.execute(
+        "UPDATE downloads SET status = 'Pending', stage = 'Waiting to resume' WHERE download_id = ?",
+        (download_id,)
+    )
+
+
+def get_lease_holders():
+    """Return the worker IDs holding leases on jobs in progress."""
+    return [row[0] for row in query_all(
+        "SELECT DISTINCT worker_id FROM jobs WHERE state IN ('running', 'transcoding') AND worker_id IS NOT NULL"
+    )]
+
+
+def expire_leases(worker_ids):
+    """End the leases of worker processes known to be gone, so their jobs are requeued without waiting."""
+    with transaction(immediate=True):
+        executemany(
+            "UPDATE jobs SET lease_expires = 0 WHERE worker_id = ? AND state IN ('running', 'transcoding')",
+            [(worker_id,) for worker_id in worker_ids]
+        )
+
+
+def requeue_expired_jobs():
+    """Re-enqueue jobs with expired leases. Returns the number of jobs found."""
+    with transaction(immediate=True) as conn:
+        return _requeue_expired(conn, time.time())
+
+
+# Queued jobs in the order claim_job takes them: priority class (with aging), then the session
+# with the least work done so far (start-time fair queuing on job cost), then submission time
+QUEUE_ORDER = f'{EFFECTIVE_PRIORITY}, COALESCE(s.virtual_time, 0), j.created_at'
+
+
+def claim_job(worker_id, max_concurrency):
+    """
+    Lease the next queued job to worker_id (jobs deferred with defer_job wait until not_before).
+    Jobs are taken in QUEUE_ORDER, skipping sessions that already have JOB_MAX_PER_SESSION jobs
+    in progress. The session's virtual time then advances by the job's cost.
+    Returns (download_id, job_type, payload, queued_at) or None if no job can start or max_concurrency
+    jobs are already downloading across all worker processes (jobs handed to a transcode
+    pool do not count).
+    """
+    now = time.time()
+    with transaction(immediate=True) as conn:
+        _requeue_expired(conn, now)
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'running'").fetchone()[0]
+        row = None
+        if running < max_concurrency:
+            row = conn.execute(
+                'SELECT j.download_id, j.job_type, j.payload, j.session_id, j.cost, j.updated_at FROM jobs j '
+                'LEFT JOIN job_sessions s ON s.session_id = j.session_id '
+                "WHERE j.state = 'queued' AND (j.not_before IS NULL OR j.not_before <= ?) "
+                'AND (j.session_id IS NULL OR j.session_id NOT IN ('
+                "  SELECT session_id FROM jobs WHERE state IN ('running', 'transcoding') AND session_id IS NOT NULL "
+                '  GROUP BY session_id HAVING COUNT(*) >= ?)) '
+                f'ORDER BY {QUEUE_ORDER} LIMIT 1',
+                (now, JOB_MAX_PER_SESSION, now, JOB_PRIORITY_AGING)
+            ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE download_id = ?",
+                (worker_id, now + JOB_LEASE_SECONDS, now, row[0])
+            )
+            conn.execute(
+                'UPDATE job_sessions SET virtual_time = virtual_time + ? WHERE session_id = ?',
+                (row[4] or 0, row[3])
+            )
+    if not row:
+        return None
+    # updated_at of a queued job is when it was enqueued, requeued or deferred
+    return row[0], row[1], json.loads(row[2]), row[5]
+
+
+def get_queue_positions():
+    """Return {download_id: position} for queued jobs (1 = next), in the order claim_job takes them."""
+    rows = query_all(
+        'SELECT j.download_id FROM jobs j LEFT JOIN job_sessions s ON s.session_id = j.session_id '
+        f"WHERE j.state = 'queued' ORDER BY {QUEUE_ORDER}",
+        (time.time(), JOB_PRIORITY_AGING)
+    )
+    return {row[0]: position for position, row in enumerate(rows, 1)}
+
+
+def renew_leases(worker_id, download_ids):
+    """Extend the lease of jobs still being processed by worker_id."""
+    if not download_ids:
+        return
+    now = time.time()
+    with transaction(immediate=True):
+        executemany(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+            "WHERE download_id = ? AND worker_id = ? AND state IN ('running', 'transcoding')",
+            [(now + JOB_LEASE_SECONDS, now, download_id, worker_id) for download_id in download_ids]
+        )
+
+
+def mark_transcoding(download_id, worker_id):
+    """Record that a leased job left the download stage; its lease stays with worker_id."""
+    execute(
+        "UPDATE jobs SET state = 'transcoding', updated_at = ? WHERE download_id = ? AND worker_id = ?",
+        (time.time(), download_id, worker_id)
+    )
+
+
+def defer_job(download_id, worker_id, delay):
+    """
+    Return a leased job to the queue for at least delay seconds without counting the attempt.
+    Its cost is refunded to the session, which is charged again when the job is claimed next.
+    """
+    now = time.time()
+    with transaction(immediate=True) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET state = 'queued', worker_id = NULL, lease_expires = NULL, not_before = ?, "
+            "attempts = attempts - 1, updated_at = ? WHERE download_id = ? AND worker_id = ?",
+            (now + delay, now, download_id, worker_id)
+        )
+        if cursor.rowcount:
+            _refund_cost(conn, download_id)
+
+
+def _refund_cost(conn, download_id):
+    conn.execute(
+        'UPDATE job_sessions SET virtual_time = virtual_time - '
+        '(SELECT COALESCE(cost, 0) FROM jobs WHERE download_id = ?) '
+        'WHERE session_id = (SELECT session_id FROM jobs WHERE download_id = ?)',
+        (download_id, download_id)
+    )
+
+
+def release_jobs(worker_id, download_ids):
+    """
+    Return the jobs of a worker process that is shutting down to the queue without counting
+    the attempt, so another worker resumes them from their checkpoints right away.
+    """
+    now = time.time()
+    with transaction(immediate=True) as conn:
+        for download_id in download_ids:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'queued', worker_id = NULL, lease_expires = NULL, not_before = NULL, "
+                "attempts = attempts - 1, updated_at = ? WHERE download_id = ? AND worker_id = ? "
+                "AND state IN ('running', 'transcoding')",
+                (now, download_id, worker_id)
+            )
+            if cursor.rowcount:
+                _refund_cost(conn, download_id)
+                _mark_resuming(conn, download_id)
+
+
+def load_checkpoint(download_id):
+    """
+    Return the checkpoint of a job: the stage it reached, the partial files it wrote
+    ('partial_files') and, for playlists, its output directory ('playlist_dir'). It is empty
+    for a job that has not run before; otherwise the job was interrupted and is resuming.
+    """
+    row = query_one('SELECT checkpoint FROM jobs WHERE download_id = ?', (download_id,))
+    return json.loads(row[0]) if row and row[0] else {}
+
+
+def remove_partial_files(download_id):
+    """Delete the partial downloads a failed job left behind (see load_checkpoint)."""
+    for path in load_checkpoint(download_id).get('partial_files', []):
+        # Fragmented downloads keep their resume state next to the .part file
+        for leftover in (path, f'{path}.ytdl'):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+
+
+def finish_job_lease(download_id, worker_id, state):
+    """Mark a leased job as 'done' or 'failed'."""
+    execute(
+        'UPDATE jobs SET state = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? '
+        'WHERE download_id = ? AND worker_id = ?',
+        (state, time.time(), download_id, worker_id)
+    )
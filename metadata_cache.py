@@ -0,0 +1,167 @@
+import json
+import re
+import time
+import zlib
+
+from config import METADATA_CACHE_MAX_ENTRIES, METADATA_CACHE_TTL
+from db import query_one, transaction
+from metrics import stage_timer
+
+VIDEO_ID_REGEX = r'(?:[?&]v=|youtu\.be/|/shorts/)([\w-]{11})'
+PLAYLIST_ID_REGEX = r'[?&]list=([\w-]+)'
+
+
+def get_canonical_id(url):
+    """Return a stable cache key ('video:<id>' or 'playlist:<id>') for a YouTube URL."""
+    # watch?v=...&list=... is treated as a playlist everywhere else in the app
+    match = re.search(PLAYLIST_ID_REGEX, url)
+    if match:
+        return f'playlist:{match.group(1)}'
+    match = re.search(VIDEO_ID_REGEX, url)
+    if match:
+        return f'video:{match.group(1)}'
+    return f'url:{url.strip()}'
+
+
+def _increment_stat(conn, name):
+    conn.execute(
+        'INSERT INTO metadata_cache_stats (name, value) VALUES (?, 1) '
+        'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+        (name,)
+    )
+
+
+def peek_cached_info(url):
+    """Return unexpired cached metadata for a URL, or None, without counting a hit or miss."""
+    row = query_one(
+        'SELECT info FROM metadata_cache WHERE cache_key = ? AND fetched_at >= ?',
+        (get_canonical_id(url), time.time() - METADATA_CACHE_TTL)
+    )
+    return json.loads(zlib.decompress(row[0])) if row else None
+
+
+def get_cached_info(url):
+    """
+    Return cached metadata for a URL without touching the network, or None. Counts a hit or
+    miss, so it is only for lookups that fetch on a miss (peek_cached_info otherwise).
+    """
+    cache_key = get_canonical_id(url)
+    now = time.time()
+    # Read then write: a deferred transaction could not upgrade its read lock while another
+    # process writes (SQLITE_BUSY at once, busy_timeout does not apply)
+    with transaction(immediate=True) as conn:
+        row = conn.execute(
+            'SELECT info, fetched_at FROM metadata_cache WHERE cache_key = ?',
+            (cache_key,)
+        ).fetchone()
+        if row and now - row[1] <= METADATA_CACHE_TTL:
+            conn.execute(
+                'UPDATE metadata_cache SET last_accessed = ? WHERE cache_key = ?',
+                (now, cache_key)
+            )
+            _increment_stat(conn, 'hits')
+            return json.loads(zlib.decompress(row[0]))
+        if row:
+            conn.execute('DELETE FROM metadata_cache WHERE cache_key = ?', (cache_key,))
+        _increment_stat(conn, 'misses')
+    return None
+
+
+def store_info(url, info):
+    """Store metadata for a URL and evict least recently used entries over the limit."""
+    cache_key = get_canonical_id(url)
+    now = time.time()
+    blob = zlib.compress(json.dumps(info).encode('utf-8'))
+    with transaction() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO metadata_cache (cache_key, info, fetched_at, last_accessed) VALUES (?, ?, ?, ?)',
+            (cache_key, blob, now, now)
+        )
+        conn.execute(
+            'DELETE FROM metadata_cache WHERE cache_key NOT IN '
+            '(SELECT cache_key FROM metadata_cache ORDER BY last_accessed DESC LIMIT ?)',
+            (METADATA_CACHE_MAX_ENTRIES,)
+        )
+
+
+def get_video_info(url):
+    """
+    Return yt_dlp metadata for a video or playlist, using the shared cache.
+    Playlists are extracted flat, so entries only carry basic fields (id, title, duration).
+    """
+    info = get_cached_info(url)
+    if info is not None:
+        return info
+
+    # yt_dlp is imported on first use, so the web tier, which only reads cached metadata,
+    # never loads it
+    import yt_dlp
+
+    ydl_opts = {'extract_flat': get_canonical_id(url).startswith('playlist:'), 'quiet': True}
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl, stage_timer('extract_info'):
+        info = ydl.extract_info(url, download=False)
+        if not info:
+            return None
+        info = ydl.sanitize_info(info)
+    store_info(url, info)
+    return info
+
+
+def open_playlist(url):
+    """
+    List a playlist lazily. Returns (info, entries): the playlist's metadata without its entries
+    (None if nothing was found) and an iterator over its flat entries that fetches further pages
+    of the listing as it is consumed, so callers can start on the first entries while later ones
+    are still being listed. Once the iterator is exhausted the whole listing is cached as
+    get_video_info would cache it; a cached listing is replayed without the network.
+    """
+    info = get_cached_info(url)
+    if info is not None:
+        return {key: value for key, value in info.items() if key != 'entries'}, iter(info.get('entries') or [])
+
+    import yt_dlp
+
+    ydl = yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True})
+    try:
+        with stage_timer('extract_info'):
+            info = ydl.extract_info(url, download=False, process=False)
+            # watch?v=...&list=... URLs resolve to the playlist itself
+            while info and info.get('_type') in ('url', 'url_transparent'):
+                info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+    except Exception:
+        ydl.close()
+        raise
+    if not info:
+        ydl.close()
+        return None, iter(())
+    pages = info.pop('entries', None) or []
+    info = ydl.sanitize_info(info)
+
+    def entries():
+        listed = []
+        try:
+            for entry in pages:
+                entry = ydl.sanitize_info(entry) if entry else entry
+                listed.append(entry)
+                yield entry
+        finally:
+            ydl.close()
+        store_info(url, dict(info, entries=listed))
+
+    return info, entries()
+
+
+def get_cache_stats():
+    """Return hit/miss counters and the current number of cached entries."""
+    with transaction() as conn:
+        stats = dict(conn.execute('SELECT name, value FROM metadata_cache_stats').fetchall())
+        entries = conn.execute('SELECT COUNT(*) FROM metadata_cache').fetchone()[0]
+    hits = stats.get('hits', 0)
+    misses = stats.get('misses', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 3) if total else 0.0,
+        'entries': entries,
+    }
@@ -0,0 +1,223 @@
+import atexit
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import db
+import tracing
+from config import METRICS_FLUSH_INTERVAL, METRICS_RETIRE_AFTER
+
+logger = logging.getLogger(__name__)
+
+# name -> (type, help). Histograms are stored as <name>_bucket/_sum/_count rows.
+METRICS = {
+    'ytdl_jobs': ('gauge', 'Jobs in the jobs table by state (read at scrape time).'),
+    'ytdl_jobs_finished_total': ('counter', 'Jobs finished by the workers by job type and result.'),
+    'ytdl_job_duration_seconds': ('histogram', 'Time from claiming a job until it finished, by job type.'),
+    'ytdl_stage_duration_seconds': ('histogram', 'Time spent in extract_info, download, ffmpeg, zip and zip_stream steps.'),
+    'ytdl_transcode_queue_depth': ('gauge', 'Transcode steps waiting for a transcode thread.'),
+    'ytdl_worker_active_jobs': ('gauge', 'Jobs held by worker processes, in either stage.'),
+    'ytdl_db_lock_wait_seconds': ('histogram', 'Time waiting for the SQLite write lock (BEGIN IMMEDIATE).'),
+    'ytdl_download_bytes_served_total': ('counter', 'Bytes sent by /download.'),
+    'ytdl_cleanup_sweep_duration_seconds': ('histogram', 'Duration of expired session sweeps.'),
+    'ytdl_cleanup_files_removed_total': ('counter', 'Files and directories removed by session sweeps.'),
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf'))
+
+
+def _format_labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_le(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class Registry:
+    """
+    Counters, gauges and histograms of this process, kept in memory so recording costs a
+    dict update under a lock. A thread writes them to the metrics table every
+    METRICS_FLUSH_INTERVAL seconds, where /metrics sums them across processes.
+    """
+
+    def __init__(self, interval=METRICS_FLUSH_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.values = {}  # (name, labels) -> value; histogram rows are cumulative per bucket
+        self.dirty = set()
+        self.pid = None
+        self.process_id = None
+        # A fork while another thread holds the lock (gunicorn --preload, worker.py restarting a
+        # process) would leave it locked forever in the child
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self.lock = threading.Lock()
+
+    def _check_process(self):
+        # Values inherited across fork() belong to the parent
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.process_id = f'{socket.gethostname()}-{self.pid}-{uuid.uuid4().hex[:8]}'
+            self.values, self.dirty = {}, set()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _format_labels(labels))
+        with self.lock:
+            self._check_process()
+            self.values[key] = self.values.get(key, 0) + amount
+            self.dirty.add(key)
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, _format_labels(labels))
+        with self.lock:
+            self._check_process()
+            self.values[key] = value
+            self.dirty.add(key)
+
+    def observe(self, name, value, **labels):
+        label_str = _format_labels(labels)
+        prefix = f'{label_str},' if label_str else ''
+        with self.lock:
+            self._check_process()
+            first = bisect.bisect_left(BUCKETS, value)
+            for index, bound in enumerate(BUCKETS):
+                # Every bucket exists from the first observation on, as histogram_quantile() expects
+                key = (f'{name}_bucket', f'{prefix}le="{_format_le(bound)}"')
+                self.values[key] = self.values.get(key, 0) + (index >= first)
+                self.dirty.add(key)
+            for key, amount in (((f'{name}_sum', label_str), value), ((f'{name}_count', label_str), 1)):
+                self.values[key] = self.values.get(key, 0) + amount
+                self.dirty.add(key)
+
+    def flush(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            rows = [(self.process_id, name, labels, self.values[(name, labels)]) for name, labels in self.dirty]
+            self.dirty = set()
+        with db.transaction(immediate=True) as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO metrics (process_id, name, labels, value) VALUES (?, ?, ?, ?)', rows
+            )
+            # Gauges of processes that stopped flushing are left out of /metrics
+            conn.execute(
+                'INSERT OR REPLACE INTO metrics_processes (process_id, updated_at) VALUES (?, ?)',
+                (self.process_id, time.time())
+            )
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush metrics')
+
+
+registry = Registry()
+atexit.register(registry.flush)
+inc = registry.inc
+set_gauge = registry.set_gauge
+observe = registry.observe
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the duration of the enclosed block (also when it raises) in a histogram."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time an extract_info, download, ffmpeg, zip or zip_stream step. It is also recorded as a
+    span of the job bound to the thread (tracing.py), which is given to the block to add bytes
+    and CPU time to.
+    """
+    span = tracing.Span(stage)
+    try:
+        yield span
+    finally:
+        span.finish()
+        observe('ytdl_stage_duration_seconds', span.duration, stage=stage)
+
+
+def _family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and METRICS.get(name[:-len(suffix)], ('',))[0] == 'histogram':
+            return name[:-len(suffix)]
+    return name
+
+
+def retire_stale_processes():
+    """
+    Fold the counters and histograms of processes that stopped flushing METRICS_RETIRE_AFTER
+    seconds ago into one 'retired' row each and drop their gauges, so restarts do not grow the table.
+    """
+    cutoff = time.time() - METRICS_RETIRE_AFTER
+    with db.transaction(immediate=True) as conn:
+        stale = [row[0] for row in conn.execute(
+            'SELECT process_id FROM metrics_processes WHERE updated_at < ?', (cutoff,)
+        )]
+        for process_id in stale:
+            for name, labels, value in conn.execute(
+                'SELECT name, labels, value FROM metrics WHERE process_id = ?', (process_id,)
+            ).fetchall():
+                if METRICS.get(_family(name), ('gauge',))[0] != 'gauge':
+                    conn.execute(
+                        "INSERT INTO metrics (process_id, name, labels, value) VALUES ('retired', ?, ?, ?) "
+                        'ON CONFLICT(process_id, name, labels) DO UPDATE SET value = value + excluded.value',
+                        (name, labels, value)
+                    )
+            conn.execute('DELETE FROM metrics WHERE process_id = ?', (process_id,))
+            conn.execute('DELETE FROM metrics_processes WHERE process_id = ?', (process_id,))
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format, summed across processes."""
+    registry.flush()
+    live_after = time.time() - 3 * METRICS_FLUSH_INTERVAL
+    totals = {}
+    for name, labels, value, updated_at in db.query_all(
+        'SELECT m.name, m.labels, m.value, p.updated_at FROM metrics m '
+        'LEFT JOIN metrics_processes p ON p.process_id = m.process_id'
+    ):
+        if METRICS.get(_family(name), ('gauge',))[0] == 'gauge' and (updated_at or 0) < live_after:
+            continue
+        totals[(name, labels)] = totals.get((name, labels), 0) + value
+    for state, count in db.query_all('SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+        totals[('ytdl_jobs', _format_labels({'state': state}))] = count
+
+    def sort_key(item):
+        (name, labels), _ = item
+        # Per label set: buckets in increasing order of le, then _sum and _count
+        family = _family(name)
+        if name.endswith('_bucket'):
+            rest, _, le = labels.rpartition('le="')
+            return (family, rest.rstrip(','), 0, float(le.rstrip('"')))
+        return (family, labels, {'_sum': 1, '_count': 2}.get(name[len(family):], 0), 0)
+
+    lines, current = [], None
+    for (name, labels), value in sorted(totals.items(), key=sort_key):
+        family = _family(name)
+        if family != current:
+            current = family
+            metric_type, help_text = METRICS.get(family, ('untyped', ''))
+            lines += [f'# HELP {family} {help_text}', f'# TYPE {family} {metric_type}']
+        lines.append(f'{name}{{{labels}}} {_format_value(value)}' if labels else f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+from config import OUTPUT_CACHE_DIR, OUTPUT_CACHE_MAX_BYTES
+from db import transaction
+from metadata_cache import get_canonical_id
+from storage import artifact_size
+
+
+def get_output_key(url, format_type, bitrate_or_res, start_time='', end_time='', mute=False):
+    """Build the content key for a finished rendition of a URL."""
+    parts = [get_canonical_id(url), format_type or '', bitrate_or_res or '',
+             start_time or '', end_time or '', 'mute' if mute else '']
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _link_file(src, dest):
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        raise
+    except OSError:
+        shutil.copy2(src, dest)
+    return dest
+
+
+def link_artifact(src, dest, suffix=None):
+    """
+    Hard-link src to dest, falling back to a copy across filesystems. Directories are linked file by file.
+    If dest already exists and is not src (e.g. another download of the same title in the session),
+    the link is named <dest>-<suffix> instead (default suffix: random). Returns the path linked.
+    """
+    try:
+        if not os.path.isdir(src):
+            return _link_file(src, dest)
+        if os.path.exists(dest):
+            raise FileExistsError(dest)
+        shutil.copytree(src, dest, copy_function=_link_file)
+        return dest
+    except FileExistsError:
+        if os.path.samefile(src, dest):
+            return dest
+    base, ext = (dest, '') if os.path.isdir(src) else os.path.splitext(dest)
+    return link_artifact(src, f'{base}-{suffix or uuid.uuid4().hex[:8]}{ext}')
+
+
+def _remove_artifact(path):
+    entry_dir = os.path.dirname(path)
+    try:
+        shutil.rmtree(entry_dir)
+    except Exception:
+        pass
+
+
+def fetch_cached_output(cache_key, user_dir, download_id=None):
+    """
+    Link a cached rendition into user_dir, named after download_id if the session already has a
+    different file of the same name.
+    Returns the path inside user_dir, or None if there is no usable cache entry.
+    """
+    # Immediate, as the lookup is followed by a write (see metadata_cache.get_cached_info)
+    with transaction(immediate=True) as conn:
+        row = conn.execute('SELECT path FROM output_cache WHERE cache_key = ?', (cache_key,)).fetchone()
+        if not row:
+            return None
+        cached_path = row[0]
+        if not os.path.exists(cached_path):
+            conn.execute('DELETE FROM output_cache WHERE cache_key = ?', (cache_key,))
+            return None
+        conn.execute('UPDATE output_cache SET last_used = ? WHERE cache_key = ?', (time.time(), cache_key))
+
+    os.makedirs(user_dir, exist_ok=True)
+    try:
+        return link_artifact(cached_path, os.path.join(user_dir, os.path.basename(cached_path)), download_id)
+    except OSError:
+        return None
+
+
+def store_output(cache_key, file_path):
+    """Add a finished rendition to the store and evict least recently used entries over the size budget."""
+    entry_dir = os.path.join(OUTPUT_CACHE_DIR, cache_key)
+    cached_path = os.path.join(entry_dir, os.path.basename(file_path))
+    if not os.path.exists(cached_path):
+        # Link under a temporary name first so concurrent readers never see a partial entry
+        tmp_path = os.path.join(entry_dir, f'.{uuid.uuid4().hex}.tmp')
+        os.makedirs(entry_dir, exist_ok=True)
+        link_artifact(file_path, tmp_path)
+        os.replace(tmp_path, cached_path)
+
+    size = artifact_size(cached_path)
+    with transaction() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO output_cache (cache_key, path, size, last_used) VALUES (?, ?, ?, ?)',
+            (cache_key, cached_path, size, time.time())
+        )
+    evict_outputs()
+
+
+def evict_outputs(max_bytes=OUTPUT_CACHE_MAX_BYTES):
+    """Remove least recently used entries until the store fits in max_bytes."""
+    evicted = []
+    with transaction(immediate=True) as conn:
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM output_cache').fetchone()[0]
+        if total <= max_bytes:
+            return
+        for cache_key, path, size in conn.execute(
+            'SELECT cache_key, path, size FROM output_cache ORDER BY last_used ASC'
+        ).fetchall():
+            if total <= max_bytes:
+                break
+            conn.execute('DELETE FROM output_cache WHERE cache_key = ?', (cache_key,))
+            evicted.append(path)
+            total -= size
+
+    # Session copies are separate hard links, so removing the store entry never breaks a download
+    for path in evicted:
+        _remove_artifact(path)
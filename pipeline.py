@@ -0,0 +1,101 @@
+import logging
+import queue
+import threading
+import time
+
+from tracing import propagate, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class TranscodePool:
+    """
+    Runs the CPU-bound steps of jobs (ffmpeg encodes, playlist packaging) on their own threads,
+    separate from the threads that download.
+
+    Job handlers that have such steps are generators: they download, then yield a list of
+    zero-argument callables and are resumed with the list of their results (or the first
+    exception they raised) on the transcode thread that finished last. Steps yielded after
+    that run inline on the same thread.
+
+    Steps wait in a bounded queue; submitting blocks while it is full, so download threads
+    stop taking new jobs when transcoding falls behind.
+    """
+
+    def __init__(self, num_threads, queue_size):
+        self.tasks = queue.Queue(maxsize=queue_size)
+        self.local = threading.local()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        self.local.is_transcode_thread = True
+        while True:
+            task = self.tasks.get()
+            try:
+                task()
+            except Exception:
+                logger.exception('Transcode step failed')
+
+    def run_job(self, job, on_transcode, on_done):
+        """
+        Drive a handler generator on the calling (download) thread until it yields its first
+        steps, then hand it over. on_transcode() is called once before the hand-over and
+        on_done(succeeded) when the handler returns or raises.
+        """
+        self._advance(job, on_transcode, on_done, None, None)
+
+    def _advance(self, job, on_transcode, on_done, results, error):
+        while True:
+            try:
+                steps = job.throw(error) if error else job.send(results)
+            except StopIteration:
+                on_done(True)
+                return
+            except Exception:
+                # Handlers record the error status themselves
+                logger.exception('Job failed')
+                on_done(False)
+                return
+
+            if getattr(self.local, 'is_transcode_thread', False):
+                # Already on a transcode thread: queueing here could deadlock on a full queue
+                results, error = [], None
+                for step in steps:
+                    try:
+                        results.append(step())
+                    except Exception as e:
+                        error = error or e
+                continue
+
+            if not steps:
+                results, error = [], None
+                continue
+            on_transcode()
+            self._submit(job, on_transcode, on_done, steps)
+            return
+
+    def _submit(self, job, on_transcode, on_done, steps):
+        lock = threading.Lock()
+        state = {'remaining': len(steps), 'results': [None] * len(steps), 'error': None}
+        download_id = tracer.current_job()
+
+        @propagate
+        def run_step(index, step, queued_at):
+            if download_id:
+                tracer.record(download_id, 'transcode_queue', queued_at, time.time() - queued_at)
+            try:
+                result, error = step(), None
+            except Exception as e:
+                result, error = None, e
+            with lock:
+                state['results'][index] = result
+                state['error'] = state['error'] or error
+                state['remaining'] -= 1
+                last = state['remaining'] == 0
+            if last:
+                self._advance(job, on_transcode, on_done, state['results'], state['error'])
+
+        for index, step in enumerate(steps):
+            self.tasks.put(lambda index=index, step=step, queued_at=time.time(): run_step(index, step, queued_at))
@@ -0,0 +1,237 @@
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+from db import transaction, write_buffer
+from metrics import stage_timer
+from storage import artifact_size
+from tracing import Span, add_bytes
+
+PROGRESS_FIELDS = ('stage', 'bytes_downloaded', 'total_bytes', 'speed', 'eta', 'percent',
+                   'entry_index', 'entry_count')
+
+
+class ProgressReporter:
+    """
+    Collects progress from yt_dlp hooks and ffmpeg and queues it for the downloads row.
+    Updates go through db.write_buffer, so however often the hooks fire the row is written
+    at most once every DB_WRITE_FLUSH_INTERVAL seconds.
+    One reporter may be shared by the threads downloading a playlist's entries.
+    With a checkpoint (jobs.load_checkpoint) it also records the job's stage and the partial
+    files yt_dlp writes, so an interrupted job can be resumed and cleaned up.
+    """
+
+    def __init__(self, download_id, checkpoint=None):
+        self.download_id = download_id
+        self.lock = threading.Lock()
+        self.files = {}  # filename -> (downloaded_bytes, total_bytes, speed)
+        self.values = dict.fromkeys(PROGRESS_FIELDS)
+        self.checkpoint = checkpoint
+        self.merge_spans = {}  # thread ident -> tracing.Span of the Merger postprocessor running on it
+
+    def _write_checkpoint(self):
+        write_buffer.update('jobs', {'download_id': self.download_id}, {'checkpoint': json.dumps(self.checkpoint)})
+
+    def save_checkpoint(self, **values):
+        """Record stage, playlist_dir and the like in the job's checkpoint."""
+        if self.checkpoint is None:
+            return
+        with self.lock:
+            self.checkpoint.update(values)
+            self._write_checkpoint()
+
+    def _write(self):
+        write_buffer.update(
+            'downloads', {'download_id': self.download_id},
+            dict(self.values, progress_updated_at=time.time())
+        )
+
+    def set_stage(self, stage):
+        with self.lock:
+            if self.values['stage'] != stage:
+                self.values['stage'] = stage
+                self.values['percent'] = None
+                self.values['eta'] = None
+                self._write()
+
+    def set_entry_count(self, entry_count):
+        with self.lock:
+            self.values['entry_count'] = entry_count
+            self.values['entry_index'] = 0
+            self._write()
+
+    def entry_listed(self, entry_count):
+        """Raise the entry count while a playlist is still being listed."""
+        with self.lock:
+            if (self.values['entry_count'] or 0) < entry_count:
+                self.values['entry_count'] = entry_count
+                self._write()
+
+    def entry_finished(self):
+        """Count a finished playlist entry."""
+        with self.lock:
+            self.values['entry_index'] = (self.values['entry_index'] or 0) + 1
+            self._write()
+
+    def download_hook(self, d):
+        """yt_dlp progress hook."""
+        if d['status'] not in ('downloading', 'finished'):
+            return
+        with self.lock:
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            downloaded = d.get('downloaded_bytes') or 0
+            if d['status'] == 'finished':
+                total = total or downloaded
+                add_bytes(downloaded or total or 0)
+            self.files[d.get('filename')] = (downloaded, total or 0, d.get('speed') or 0)
+            partial_file = d.get('tmpfilename')
+            if self.checkpoint is not None and partial_file and partial_file != d.get('filename'):
+                partial_files = self.checkpoint.setdefault('partial_files', [])
+                if partial_file not in partial_files:
+                    partial_files.append(partial_file)
+                    self._write_checkpoint()
+            self.values['stage'] = 'Downloading'
+            self.values['bytes_downloaded'] = sum(f[0] for f in self.files.values())
+            self.values['total_bytes'] = sum(f[1] for f in self.files.values()) or None
+            self.values['speed'] = sum(f[2] for f in self.files.values() if f[0] < f[1]) or None
+            self.values['eta'] = d.get('eta')
+            if self.values['total_bytes']:
+                self.values['percent'] = round(100 * self.values['bytes_downloaded'] / self.values['total_bytes'], 1)
+            self._write()
+
+    def postprocessor_hook(self, d):
+        """yt_dlp postprocessor hook: reports merge/convert stages."""
+        name = d.get('postprocessor', '')
+        if name == 'Merger':
+            # Merging runs on the downloading thread, so the span belongs to its job
+            if d['status'] == 'started':
+                self.merge_spans[threading.get_ident()] = Span('merge')
+            elif d['status'] == 'finished' and threading.get_ident() in self.merge_spans:
+                self.merge_spans.pop(threading.get_ident()).finish()
+        if d['status'] != 'started':
+            return
+        if name == 'Merger':
+            self.set_stage('Merging')
+        elif name in ('ExtractAudio', 'VideoRemuxer', 'VideoConvertor'):
+            self.set_stage('Converting')
+
+    def ydl_hooks(self):
+        """Options to merge into yt_dlp options."""
+        return {
+            'progress_hooks': [self.download_hook],
+            'postprocessor_hooks': [self.postprocessor_hook],
+        }
+
+    def source_progress(self, downloaded, total):
+        """Bytes of a source streamed straight into ffmpeg (the stage and percent come from ffmpeg)."""
+        with self.lock:
+            self.values['bytes_downloaded'] = downloaded
+            self.values['total_bytes'] = total
+            self._write()
+
+    def ffmpeg_progress(self, out_time, duration, speed):
+        with self.lock:
+            if duration:
+                self.values['percent'] = round(min(100.0, 100 * out_time / duration), 1)
+                if speed:
+                    self.values['eta'] = int(max(0, duration - out_time) / speed)
+            self._write()
+
+
+def update_status(download_id, status, file_path=None):
+    """
+    Update the download status in the database.
+    Buffered progress and entry updates are flushed first, so a final status is never
+    followed by stale progress. A finished file replaces the size reserved at admission
+    (storage.admit) with its real size; an error releases it.
+    """
+    write_buffer.flush()
+    with transaction() as conn:
+        if file_path:
+            conn.execute(
+                'UPDATE downloads SET status = ?, file_path = ?, size = ? WHERE download_id = ?',
+                (status, file_path, artifact_size(file_path), download_id)
+            )
+        elif status.startswith('Error'):
+            conn.execute(
+                'UPDATE downloads SET status = ?, size = 0 WHERE download_id = ?',
+                (status, download_id)
+            )
+        else:
+            conn.execute(
+                'UPDATE downloads SET status = ? WHERE download_id = ?',
+                (status, download_id)
+            )
+
+
+def _parse_ffmpeg_speed(value):
+    try:
+        return float(value.rstrip('x'))
+    except ValueError:
+        return None
+
+
+def _feed_stdin(process, input_chunks, errors):
+    try:
+        for chunk in input_chunks:
+            process.stdin.write(chunk)
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its return code reports why
+    except Exception as e:
+        # Kill ffmpeg so a truncated input is never mistaken for a finished encode
+        errors.append(e)
+        process.kill()
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def run_ffmpeg(ffmpeg_cmd, reporter=None, duration=None, stage='Converting', input_chunks=None):
+    """
+    Run ffmpeg, feeding its -progress output to reporter.
+    If input_chunks (an iterable of bytes) is given it is written to ffmpeg's stdin from a
+    separate thread, for commands reading 'pipe:0'; the pipe keeps memory use bounded.
+    Raises subprocess.CalledProcessError (with stderr) on failure, like subprocess.run(check=True),
+    or the exception raised while producing input_chunks.
+    """
+    if reporter:
+        reporter.set_stage(stage)
+    cmd = [ffmpeg_cmd[0], '-progress', 'pipe:1', '-nostats'] + ffmpeg_cmd[1:]
+    # stderr goes to a temporary file so a chatty ffmpeg cannot block on a full pipe
+    with stage_timer('ffmpeg') as span, tempfile.TemporaryFile(mode='w+b') as stderr_file:
+        process = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL if input_chunks is None else subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=stderr_file
+        )
+        feed_errors = []
+        feeder = None
+        if input_chunks is not None:
+            feeder = threading.Thread(target=_feed_stdin, args=(process, input_chunks, feed_errors), daemon=True)
+            feeder.start()
+        out_time, speed = 0, None
+        for line in process.stdout:
+            key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+            if key == 'out_time_us' and value.isdigit():
+                out_time = int(value) / 1_000_000
+            elif key == 'speed':
+                speed = _parse_ffmpeg_speed(value)
+            elif key == 'progress' and reporter:
+                reporter.ffmpeg_progress(out_time, duration, speed)
+        # wait4 also gives the CPU time ffmpeg used, recorded on the job's span
+        _, status, rusage = os.wait4(process.pid, 0)
+        returncode = process.returncode = os.waitstatus_to_exitcode(status)
+        span.cpu_seconds = rusage.ru_utime + rusage.ru_stime
+        if os.path.isfile(ffmpeg_cmd[-1]):
+            span.bytes = os.path.getsize(ffmpeg_cmd[-1])
+        if feeder:
+            feeder.join()
+        if feed_errors:
+            raise feed_errors[0]
+        if returncode != 0:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr_file.read().decode('utf-8', 'replace'))
@@ -11,5 +11,5 @@ fi
 # Run the application
 sudo supervisorctl reread
 sudo supervisorctl update
-sudo supervisorctl start youtube_downloader
-sudo supervisorctl status youtube_downloader
\ No newline at end of file
+sudo supervisorctl start youtube_downloader youtube_downloader_worker
+sudo supervisorctl status youtube_downloader youtube_downloader_worker
\ No newline at end of file
@@ -2,8 +2,8 @@
 
 # Stop the application
 echo "Stopping youtube_downloader..."
-sudo supervisorctl stop youtube_downloader
-sudo supervisorctl status youtube_downloader
+sudo supervisorctl stop youtube_downloader youtube_downloader_worker
+sudo supervisorctl status youtube_downloader youtube_downloader_worker
 
 # Check if virtual environment is active and deactivate if necessary
 if [ -n "$VIRTUAL_ENV" ]; then
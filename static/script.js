@@ -57,43 +57,144 @@ function resetButton(button, downloadLink, formType) {
     downloadLink.href = '#';
 }
 
-function checkStatus(downloadId, button, downloadLink, formType) {
-    fetch(`/status/${downloadId}`)
+function formatBytes(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB'];
+    let i = 0;
+    while (bytes >= 1024 && i < units.length - 1) {
+        bytes /= 1024;
+        i++;
+    }
+    return `${bytes.toFixed(i ? 1 : 0)} ${units[i]}`;
+}
+
+function formatProgress(data) {
+    let text = data.stage || data.status;
+    if (data.queue_position) {
+        text += ` (#${data.queue_position} in queue)`;
+    }
+    if (data.entry_count) {
+        text += ` (${data.entry_index}/${data.entry_count})`;
+    }
+    if (data.percent !== null && data.percent !== undefined) {
+        text += ` ${Math.round(data.percent)}%`;
+    } else if (data.bytes_downloaded) {
+        text += ` ${formatBytes(data.bytes_downloaded)}`;
+    }
+    if (data.eta) {
+        text += `, ${data.eta}s left`;
+    }
+    return text;
+}
+
+// Downloads waiting for a final status, keyed by download_id
+const watchers = {};
+let eventSource = null;
+let pollTimer = null;
+
+function renderStatus(data, button, downloadLink, formType) {
+    // Returns true once the download has reached a final state
+    button.className = 'btn-status';
+    button.innerHTML = `<i class="fas fa-spinner fa-spin"></i> ${formatProgress(data)}...`;
+    button.disabled = true;
+
+    if (data.status === 'Completed' && data.file_path) {
+        button.style.display = 'none';
+        downloadLink.style.display = 'inline-flex';
+        downloadLink.href = `/download/${data.download_id}`;
+        downloadLink.onclick = (e) => {
+            e.preventDefault();
+            window.location.href = downloadLink.href;
+            resetButton(button, downloadLink, formType);
+        };
+        showToast('Your download is ready!', 'success');
+        return true;
+    } else if (data.status.includes('Error')) {
+        button.className = 'status-error';
+        button.innerHTML = `<i class="fas fa-exclamation-circle"></i> ${data.status}`;
+        button.disabled = true;
+        showToast(data.status, 'error');
+        setTimeout(() => resetButton(button, downloadLink, formType), 5000);
+        return true;
+    }
+    return false;
+}
+
+function handleStatusUpdate(data) {
+    const watcher = watchers[data.download_id];
+    if (!watcher) {
+        return;
+    }
+    if (renderStatus(data, watcher.button, watcher.downloadLink, watcher.formType)) {
+        delete watchers[data.download_id];
+        if (Object.keys(watchers).length === 0) {
+            stopStatusUpdates();
+        }
+    }
+}
+
+function pollSessionStatus() {
+    // Fallback when Server-Sent Events are unavailable: one request covers every download
+    pollTimer = null;
+    fetch('/session_status')
         .then(response => response.json())
         .then(data => {
-            button.className = 'btn-status';
-            button.innerHTML = `<i class="fas fa-spinner fa-spin"></i> ${data.status}...`;
-            button.disabled = true;
-            
-            if (data.status === 'Completed' && data.file_path) {
-                button.style.display = 'none';
-                downloadLink.style.display = 'inline-flex';
-                downloadLink.href = `/download/${downloadId}`;
-                downloadLink.onclick = (e) => {
-                    e.preventDefault();
-                    window.location.href = downloadLink.href;
-                    resetButton(button, downloadLink, formType);
-                };
-                showToast('Your download is ready!', 'success');
-            } else if (data.status.includes('Error')) {
-                button.className = 'status-error';
-                button.innerHTML = `<i class="fas fa-exclamation-circle"></i> ${data.status}`;
-                button.disabled = true;
-                showToast(data.status, 'error');
-                setTimeout(() => resetButton(button, downloadLink, formType), 5000);
-            } else {
-                setTimeout(() => checkStatus(downloadId, button, downloadLink, formType), 2000);
+            data.downloads.forEach(handleStatusUpdate);
+            if (Object.keys(watchers).length) {
+                pollTimer = setTimeout(pollSessionStatus, 2000);
             }
         })
         .catch(() => {
-            button.className = 'status-error';
-            button.innerHTML = `<i class="fas fa-exclamation-circle"></i> Error checking status`;
-            button.disabled = true;
+            Object.values(watchers).forEach(watcher => {
+                watcher.button.className = 'status-error';
+                watcher.button.innerHTML = `<i class="fas fa-exclamation-circle"></i> Error checking status`;
+                watcher.button.disabled = true;
+                setTimeout(() => resetButton(watcher.button, watcher.downloadLink, watcher.formType), 5000);
+            });
+            Object.keys(watchers).forEach(downloadId => delete watchers[downloadId]);
             showToast('Error checking download status', 'error');
-            setTimeout(() => resetButton(button, downloadLink, formType), 5000);
         });
 }
 
+function startStatusUpdates() {
+    if (eventSource || pollTimer) {
+        return;
+    }
+    if (!window.EventSource) {
+        pollSessionStatus();
+        return;
+    }
+    eventSource = new EventSource('/events');
+    eventSource.onmessage = (e) => handleStatusUpdate(JSON.parse(e.data));
+    eventSource.onerror = () => {
+        // EventSource reconnects by itself unless the browser gave up on the stream
+        if (eventSource.readyState === EventSource.CLOSED) {
+            eventSource = null;
+            pollSessionStatus();
+        }
+    };
+}
+
+function stopStatusUpdates() {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+    if (pollTimer) {
+        clearTimeout(pollTimer);
+        pollTimer = null;
+    }
+}
+
+function checkStatus(downloadId, button, downloadLink, formType) {
+    watchers[downloadId] = {button, downloadLink, formType};
+    // The stream may already have sent this download before it was watched, so fetch it once directly
+    fetch(`/status/${downloadId}`)
+        .then(response => response.json())
+        .then(handleStatusUpdate)
+        .catch(() => {});
+    startStatusUpdates();
+}
+
 document.addEventListener("DOMContentLoaded", function() {
     updateBitrate();
     document.getElementsByClassName("tablinks")[0].click();
@@ -0,0 +1,170 @@
+import os
+
+from config import AUDIO_FORMATS, DISK_BUDGET_BYTES, RESOLUTIONS, SESSION_QUOTA_BYTES
+from db import transaction
+from utils import _remove_path
+from validations import time_to_seconds
+
+EVICTED_STATUS = 'Error: File removed to free disk space'
+
+
+def artifact_size(path):
+    """Bytes used by a file or a directory tree (0 if it no longer exists)."""
+    try:
+        if os.path.isdir(path):
+            return sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, _, files in os.walk(path)
+                for name in files
+            )
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _format_size(size):
+    return f'{size / 1024**3:.1f} GB' if size >= 1024**3 else f'{size / 1024**2:.0f} MB'
+
+
+def _media_size(fmt):
+    return fmt.get('filesize') or fmt.get('filesize_approx')
+
+
+def get_media_duration(info, start_time='', end_time=''):
+    """Seconds of media a download covers: the trimmed clip, or the sum of playlist entry durations."""
+    if 'entries' in info:
+        return sum((entry or {}).get('duration') or 0 for entry in info['entries'])
+    duration = info.get('duration') or 0
+    if end_time:
+        duration = min(duration, time_to_seconds(end_time))
+    if start_time:
+        duration -= time_to_seconds(start_time)
+    return max(0, duration)
+
+
+def estimate_output_size(info, format_type, bitrate_or_res, start_time='', end_time='', mute=False):
+    """
+    Estimate the bytes a download will write from its yt_dlp metadata, or None if unknown.
+    Audio is clip duration times the requested bitrate (entry durations for playlists).
+    Video is the filesize/filesize_approx of the best stream at the requested resolution,
+    plus the best audio stream unless muted; flat playlist entries carry no sizes.
+    """
+    if not info:
+        return None
+    if format_type in AUDIO_FORMATS:
+        return int(get_media_duration(info, start_time, end_time) * int(bitrate_or_res) * 1000 / 8) or None
+
+    height = int(RESOLUTIONS.get(bitrate_or_res, 0))
+    formats = info.get('formats') or []
+    videos = [
+        fmt for fmt in formats
+        if fmt.get('vcodec') not in (None, 'none') and (fmt.get('height') or 0) <= height and _media_size(fmt)
+    ]
+    if not videos:
+        return None
+    video = max(videos, key=lambda fmt: (fmt.get('height') or 0, fmt.get('tbr') or 0))
+    size = _media_size(video)
+    if not mute and video.get('acodec') in (None, 'none'):
+        audios = [
+            fmt for fmt in formats
+            if fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none') and _media_size(fmt)
+        ]
+        if audios:
+            size += _media_size(max(audios, key=lambda fmt: fmt.get('abr') or 0))
+    return size
+
+
+def _used_bytes(conn, download_id, session_id=None):
+    # Completed downloads count their files, pending ones the size reserved at admission
+    if session_id:
+        return conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM downloads WHERE session_id = ? AND download_id IS NOT ?',
+            (session_id, download_id)
+        ).fetchone()[0]
+    return conn.execute(
+        'SELECT COALESCE(SUM(size), 0) FROM downloads WHERE download_id IS NOT ?', (download_id,)
+    ).fetchone()[0]
+
+
+def _evict(conn, needed, session_id=None):
+    """
+    Mark the least recently downloaded completed files for removal until `needed` bytes are free.
+    Files never downloaded go last. Returns the paths to remove, or None if not enough can be freed.
+    """
+    candidates = conn.execute(
+        "SELECT download_id, file_path, size FROM downloads "
+        "WHERE status = 'Completed' AND file_path IS NOT NULL AND size > 0"
+        + (' AND session_id = ?' if session_id else '')
+        + ' ORDER BY last_accessed IS NULL, last_accessed, created_at',
+        (session_id,) if session_id else ()
+    ).fetchall()
+    chosen, freed = [], 0
+    for row in candidates:
+        if freed >= needed:
+            break
+        chosen.append(row)
+        freed += row['size']
+    if freed < needed:
+        return None
+
+    conn.executemany(
+        'UPDATE downloads SET status = ?, file_path = NULL, size = 0 WHERE download_id = ?',
+        [(EVICTED_STATUS, row['download_id']) for row in chosen]
+    )
+    # A file is shared by every download in a session that hit the same cached output
+    return [
+        row['file_path'] for row in chosen
+        if not conn.execute('SELECT 1 FROM downloads WHERE file_path = ? LIMIT 1', (row['file_path'],)).fetchone()
+    ]
+
+
+def admit(download_id, session_id, estimate):
+    """
+    Reserve `estimate` bytes for a download against the per-session quota (SESSION_QUOTA_BYTES)
+    and the global budget (DISK_BUDGET_BYTES), evicting least recently downloaded files if needed.
+    Returns (decision, message) with decision 'ok', 'reject' (the session quota cannot fit it)
+    or 'defer' (the disk is full of files that cannot be evicted yet).
+    """
+    estimate = estimate or 0
+    if estimate > min(SESSION_QUOTA_BYTES, DISK_BUDGET_BYTES):
+        return 'reject', f'Estimated size ({_format_size(estimate)}) exceeds the {_format_size(min(SESSION_QUOTA_BYTES, DISK_BUDGET_BYTES))} storage limit'
+
+    removed = []
+    with transaction(immediate=True) as conn:
+        session_used = _used_bytes(conn, download_id, session_id)
+        if session_used + estimate > SESSION_QUOTA_BYTES:
+            paths = _evict(conn, session_used + estimate - SESSION_QUOTA_BYTES, session_id)
+            if paths is None:
+                return 'reject', f'Storage quota of {_format_size(SESSION_QUOTA_BYTES)} per session exceeded; wait for running downloads to finish'
+            removed += paths
+
+        total_used = _used_bytes(conn, download_id)
+        if total_used + estimate > DISK_BUDGET_BYTES:
+            paths = _evict(conn, total_used + estimate - DISK_BUDGET_BYTES)
+            if paths is None:
+                decision = ('defer', 'Waiting for disk space')
+            else:
+                removed += paths
+                decision = ('ok', None)
+        else:
+            decision = ('ok', None)
+        if decision[0] == 'ok':
+            conn.execute('UPDATE downloads SET size = ? WHERE download_id = ?', (estimate, download_id))
+
+    # Files are removed only after the transaction has committed
+    for path in removed:
+        _remove_path(path)
+    return decision
+
+
+def get_storage_usage(session_id):
+    """Bytes used (or reserved) by a session and in total, with the configured limits."""
+    with transaction() as conn:
+        session_used = _used_bytes(conn, None, session_id) if session_id else 0
+        total_used = _used_bytes(conn, None)
+    return {
+        'session_bytes': session_used,
+        'session_quota': SESSION_QUOTA_BYTES,
+        'total_bytes': total_used,
+        'total_budget': DISK_BUDGET_BYTES,
+    }
@@ -13,7 +13,7 @@ config_file_dir="/etc/supervisor/conf.d/youtube_downloader.conf"
 sudo tee "$config_file_dir" > /dev/null <<EOF
 [program:youtube_downloader]
 directory=$working_directory
-command=$working_directory/venv/bin/gunicorn -w 4 -b 0.0.0.0:5000 app:app
+command=$working_directory/venv/bin/gunicorn -c gunicorn.conf.py app:app
 autostart=true
 autorestart=true
 startretries=10
@@ -21,6 +21,19 @@ stderr_logfile=$working_directory/logs/youtube_downloader.err.log
 stdout_logfile=$working_directory/logs/youtube_downloader.out.log
 environment=PYTHONPATH="$working_directory"
 user=$USER
+
+[program:youtube_downloader_worker]
+directory=$working_directory
+command=$working_directory/venv/bin/python worker.py
+autostart=true
+autorestart=true
+startretries=10
+stopasgroup=true
+killasgroup=true
+stderr_logfile=$working_directory/logs/youtube_downloader_worker.err.log
+stdout_logfile=$working_directory/logs/youtube_downloader_worker.out.log
+environment=PYTHONPATH="$working_directory"
+user=$USER
 EOF
 
 echo "Config file created at: $config_file_dir"
\ No newline at end of file
@@ -0,0 +1,219 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import db
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MAX_DEPTH = 48
+PROFILE_TOP_STACKS = 20
+
+
+class Tracer:
+    """
+    Records timestamped spans (stage, start, duration, bytes, CPU seconds) of the job each
+    thread is working on. A thread works for a job inside bind_job(); threads a job hands work
+    to are bound with propagate(). Spans are kept in memory and written to the job_spans table
+    by flush(), which worker.py calls when a job finishes and from its heartbeat.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.threads = {}  # thread ident -> {'job': download_id, 'spans': [open spans, innermost last]}
+        self.spans = []  # finished span rows waiting for flush()
+        self.samples = {}  # (download_id, collapsed stack) -> count, from the Profiler
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Spans recorded before fork() are the parent's to flush
+        self.lock = threading.Lock()
+        self.threads, self.spans, self.samples = {}, [], {}
+
+    def current_job(self):
+        state = self.threads.get(threading.get_ident())
+        return state['job'] if state else None
+
+    @contextmanager
+    def bind_job(self, download_id):
+        """Attribute the spans of the enclosed block on this thread to download_id."""
+        ident = threading.get_ident()
+        previous = self.threads.get(ident)
+        self.threads[ident] = {'job': download_id, 'spans': []}
+        try:
+            yield
+        finally:
+            if previous is None:
+                self.threads.pop(ident, None)
+            else:
+                self.threads[ident] = previous
+
+    def propagate(self, func):
+        """Wrap func so the thread that runs it works for the job bound to the calling thread."""
+        download_id = self.current_job()
+        if download_id is None:
+            return func
+
+        def run(*args, **kwargs):
+            with self.bind_job(download_id):
+                return func(*args, **kwargs)
+        return run
+
+    def record(self, download_id, stage, started_at, duration, bytes_count=None, cpu_seconds=None):
+        with self.lock:
+            self.spans.append((download_id, stage, started_at, duration, bytes_count, cpu_seconds))
+
+    def add_bytes(self, count):
+        """Add bytes to the innermost open span of this thread (e.g. a finished yt_dlp download)."""
+        state = self.threads.get(threading.get_ident())
+        if state and state['spans']:
+            span = state['spans'][-1]
+            span.bytes = (span.bytes or 0) + count
+
+    def flush(self):
+        with self.lock:
+            spans, self.spans = self.spans, []
+            samples, self.samples = self.samples, {}
+        if not spans and not samples:
+            return
+        with db.transaction(immediate=True) as conn:
+            conn.executemany(
+                'INSERT INTO job_spans (download_id, stage, started_at, duration, bytes, cpu_seconds) '
+                'VALUES (?, ?, ?, ?, ?, ?)', spans
+            )
+            conn.executemany(
+                'INSERT INTO job_profile_samples (download_id, stack, samples) VALUES (?, ?, ?) '
+                'ON CONFLICT(download_id, stack) DO UPDATE SET samples = samples + excluded.samples',
+                [(download_id, stack, count) for (download_id, stack), count in samples.items()]
+            )
+
+
+tracer = Tracer()
+bind_job = tracer.bind_job
+propagate = tracer.propagate
+add_bytes = tracer.add_bytes
+flush = tracer.flush
+
+
+class Span:
+    """
+    One stage of the job bound to the current thread, from creation to finish(). bytes and
+    cpu_seconds may be set before it finishes. Without a bound job nothing is recorded.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.bytes = None
+        self.cpu_seconds = None
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.duration = None
+        self.state = tracer.threads.get(threading.get_ident())
+        if self.state:
+            self.state['spans'].append(self)
+
+    def finish(self):
+        self.duration = time.monotonic() - self.started
+        if self.state:
+            if self in self.state['spans']:
+                self.state['spans'].remove(self)
+            tracer.record(self.state['job'], self.stage, self.started_at, self.duration, self.bytes, self.cpu_seconds)
+
+
+class Profiler:
+    """
+    Opt-in sampling profiler for worker threads (worker.py starts it when PROFILE_INTERVAL_MS is
+    set). Every interval it takes the stack of each thread bound to a job and counts it under
+    that job, prefixed with the innermost open span's stage. Stacks are stored collapsed
+    (outermost frame first, ';'-separated), the input format of flame graph tools.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident, state in list(tracer.threads.items()):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(f'{frame.f_globals.get("__name__", "?")}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            spans = state['spans']
+            stack.append(spans[-1].stage if spans else 'job')
+            key = (state['job'], ';'.join(reversed(stack)))
+            with tracer.lock:
+                tracer.samples[key] = tracer.samples.get(key, 0) + 1
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._sample()
+            except Exception:
+                logger.exception('Profiler sample failed')
+
+
+def get_job_trace(download_id):
+    """Return a job's spans in start order (offsets in seconds from the first) and its top profiled stacks."""
+    spans = db.query_all(
+        'SELECT stage, started_at, duration, bytes, cpu_seconds FROM job_spans '
+        'WHERE download_id = ? ORDER BY started_at',
+        (download_id,)
+    )
+    origin = spans[0][1] if spans else 0
+    totals = {}
+    for stage, _, duration, _, _ in spans:
+        totals[stage] = round(totals.get(stage, 0) + duration, 3)
+    profile = db.query_all(
+        'SELECT stack, samples FROM job_profile_samples WHERE download_id = ? ORDER BY samples DESC LIMIT ?',
+        (download_id, PROFILE_TOP_STACKS)
+    )
+    return {
+        'download_id': download_id,
+        'spans': [
+            {'stage': stage, 'offset': round(started_at - origin, 3), 'started_at': started_at,
+             'duration': round(duration, 3), 'bytes': bytes_count, 'cpu_seconds': cpu_seconds}
+            for stage, started_at, duration, bytes_count, cpu_seconds in spans
+        ],
+        'totals': totals,
+        'profile': [{'stack': stack, 'samples': samples} for stack, samples in profile],
+    }
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def get_stage_stats(window):
+    """Per-stage count, total and p50/p95/p99 duration of the spans started in the last window seconds."""
+    durations = {}
+    totals = {}
+    for stage, duration, bytes_count, cpu_seconds in db.query_all(
+        'SELECT stage, duration, bytes, cpu_seconds FROM job_spans WHERE started_at >= ? ORDER BY stage, duration',
+        (time.time() - window,)
+    ):
+        durations.setdefault(stage, []).append(duration)
+        stage_totals = totals.setdefault(stage, [0, 0])
+        stage_totals[0] += bytes_count or 0
+        stage_totals[1] += cpu_seconds or 0
+    return {
+        stage: {
+            'count': len(values),
+            'total_seconds': round(sum(values), 3),
+            'p50': round(_percentile(values, 0.5), 3),
+            'p95': round(_percentile(values, 0.95), 3),
+            'p99': round(_percentile(values, 0.99), 3),
+            'bytes': totals[stage][0],
+            'cpu_seconds': round(totals[stage][1], 3),
+        }
+        for stage, values in durations.items()
+    }
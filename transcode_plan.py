@@ -0,0 +1,90 @@
+from config import PLAN_BITRATE_TOLERANCE, RESOLUTIONS
+
+# Source codecs (yt_dlp acodec prefixes) each audio format can hold without re-encoding
+AUDIO_COPY_CODECS = {
+    'mp3': ('mp3',),
+    'm4a': ('mp4a',),
+    'aac': ('mp4a',),
+    'ogg': ('opus', 'vorbis'),
+}
+# The same as ffprobe names them, for files already downloaded (see downloader.extract_audio)
+AUDIO_COPY_FILE_CODECS = {
+    'mp3': ('mp3',),
+    'm4a': ('aac',),
+    'aac': ('aac',),
+    'ogg': ('opus', 'vorbis'),
+}
+# Encoder and container options per audio format when the stream has to be re-encoded
+AUDIO_ENCODERS = {
+    'mp3': 'libmp3lame',
+    'm4a': 'aac',
+    'aac': 'aac',
+    'ogg': 'libvorbis',
+}
+AUDIO_CONTAINER_ARGS = {
+    'm4a': ['-movflags', '+faststart'],
+    'aac': ['-f', 'adts'],
+}
+
+
+def _is_audio_only(fmt):
+    return fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none')
+
+
+def _is_video_only(fmt):
+    return fmt.get('acodec') == 'none' and fmt.get('vcodec') not in (None, 'none')
+
+
+def _describe(action, fmt, codec):
+    bitrate = fmt.get('abr') or fmt.get('tbr')
+    details = f"{codec}, {round(bitrate)}k" if bitrate else codec
+    return f"{action} {fmt['format_id']} ({details})"
+
+
+def plan_audio(info, format_type, bitrate, default_format='bestaudio'):
+    """
+    Pick the source stream for an audio download from the formats in info.
+    Returns a dict with 'action' ('copy' when an audio-only stream already has a codec the output
+    format can hold and its bitrate is at most PLAN_BITRATE_TOLERANCE above the requested one,
+    otherwise 'encode'), the yt_dlp 'format' spec, its 'format_id' (copy only) and a 'description'.
+    The spec falls back to default_format if the chosen stream is no longer offered at download time.
+    """
+    max_bitrate = int(bitrate) * (1 + PLAN_BITRATE_TOLERANCE)
+    candidates = [
+        fmt for fmt in (info or {}).get('formats') or []
+        if _is_audio_only(fmt) and fmt.get('format_id')
+        and fmt['acodec'].startswith(AUDIO_COPY_CODECS.get(format_type, ()))
+        and (fmt.get('abr') or 0) <= max_bitrate
+    ]
+    if not candidates:
+        return {'action': 'encode', 'format': default_format, 'format_id': None,
+                'description': f'encode {default_format} ({format_type}, {bitrate}k)'}
+    # Highest bitrate that fits; DRC variants only as a last resort
+    best = max(candidates, key=lambda fmt: ('-drc' not in fmt['format_id'], fmt.get('abr') or 0))
+    return {'action': 'copy', 'format': f"{best['format_id']}/{default_format}", 'format_id': best['format_id'],
+            'description': _describe('copy', best, best['acodec'])}
+
+
+def plan_muted_video(info, format_type, resolution):
+    """
+    Pick the video-only stream for a muted download. When the best stream at the requested
+    resolution is already in the output container the remux step is skipped ('copy');
+    otherwise the stream is remuxed ('remux'), which copies it without re-encoding.
+    """
+    default_format = f'bestvideo[height<={RESOLUTIONS[resolution]}]'
+    candidates = [
+        fmt for fmt in (info or {}).get('formats') or []
+        if _is_video_only(fmt) and fmt.get('format_id')
+        and (fmt.get('height') or 0) <= int(RESOLUTIONS[resolution])
+    ]
+    if not candidates:
+        return {'action': 'remux', 'format': default_format, 'format_id': None,
+                'description': f'remux {default_format}'}
+    top_height = max(fmt.get('height') or 0 for fmt in candidates)
+    native = [fmt for fmt in candidates if fmt.get('ext') == format_type and (fmt.get('height') or 0) == top_height]
+    if native:
+        best = max(native, key=lambda fmt: fmt.get('tbr') or 0)
+        return {'action': 'copy', 'format': f"{best['format_id']}/{default_format}", 'format_id': best['format_id'],
+                'description': _describe('copy', best, best['vcodec'])}
+    return {'action': 'remux', 'format': default_format, 'format_id': None,
+            'description': f'remux {default_format}'}
@@ -1,65 +1,130 @@
 import datetime
 import os
-import sqlite3
-import threading
+import secrets
+import shutil
+import socket
+import time
 
-from config import SESSION_LIFETIME
+from config import CLEANUP_BATCH_SIZE, CLEANUP_LEASE_SECONDS, INFLIGHT_JOB_TIMEOUT, SECRET_KEY_FILE, SESSION_LIFETIME
 
-from init_db import DB_PATH
+from db import execute, transaction
+from metrics import inc, retire_stale_processes, timer
 
-db_lock = threading.Lock()
+SWEEPER_ID = f'{socket.gethostname()}-{os.getpid()}'
+LEGACY_SESSION_DIR = 'flask_session'  # pickle files of the former Flask-Session backend
+
+def acquire_lease(name, owner, duration):
+    """
+    Take or renew a named lease shared by all processes using downloads.db.
+    Returns True if owner holds the lease for the next `duration` seconds.
+    """
+    now = time.time()
+    with transaction(immediate=True) as conn:
+        conn.execute('INSERT OR IGNORE INTO leases (name, owner, expires_at) VALUES (?, NULL, 0)', (name,))
+        cursor = conn.execute(
+            'UPDATE leases SET owner = ?, expires_at = ? WHERE name = ? AND (owner = ? OR expires_at < ?)',
+            (owner, now + duration, name, owner, now)
+        )
+        return cursor.rowcount == 1
+
+def get_secret_key():
+    """
+    Return the key signing session cookies, which every process must share: SECRET_KEY from the
+    environment, else the contents of SECRET_KEY_FILE, generated by the first process to start.
+    """
+    env_secret_key = os.environ.get('SECRET_KEY')
+    if env_secret_key:
+        return env_secret_key
+    if not os.path.exists(SECRET_KEY_FILE):
+        # Written aside and linked into place, so no process ever reads a partial key
+        tmp_path = f'{SECRET_KEY_FILE}.{os.getpid()}'
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp_path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
+
+def touch_session(session_id):
+    """Record activity of a session. Sessions idle for SESSION_LIFETIME are swept with their directory."""
+    execute(
+        'INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) '
+        'ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen',
+        (session_id, time.time())
+    )
+
+def _remove_path(path):
+    """Remove a file or directory tree. Returns True if something was removed."""
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            return False
+        return True
+    except Exception:
+        return False
 
 def cleanup_expired_sessions():
+    """
+    Remove expired downloads, one bounded batch per call. worker.py runs it on a schedule; only
+    the process holding the 'session_sweeper' lease sweeps, so several hosts may run it.
+    Files are removed after the database transaction has committed.
+    """
+    if not acquire_lease('session_sweeper', SWEEPER_ID, CLEANUP_LEASE_SECONDS):
+        return
+
+    with timer('ytdl_cleanup_sweep_duration_seconds'):
+        removed = _sweep_expired_sessions()
+    inc('ytdl_cleanup_files_removed_total', removed)
+    retire_stale_processes()
+
+def _sweep_expired_sessions():
+    """Remove one batch of expired downloads and idle sessions. Returns the number of paths removed."""
     expiration = datetime.datetime.now() - datetime.timedelta(seconds=SESSION_LIFETIME)
+    with transaction(immediate=True) as conn:
+        expired = conn.execute(
+            'SELECT download_id, session_id, file_path FROM downloads WHERE created_at < ? '
+            'ORDER BY created_at LIMIT ?',
+            (expiration, CLEANUP_BATCH_SIZE)
+        ).fetchall()
+        download_ids = [(row[0],) for row in expired]
+        conn.executemany('DELETE FROM downloads WHERE download_id = ?', download_ids)
+        conn.executemany('DELETE FROM jobs WHERE download_id = ?', download_ids)
+        conn.executemany('DELETE FROM playlist_entries WHERE download_id = ?', download_ids)
+        conn.executemany('DELETE FROM job_spans WHERE download_id = ?', download_ids)
+        conn.executemany('DELETE FROM job_profile_samples WHERE download_id = ?', download_ids)
+        conn.execute('DELETE FROM job_sessions WHERE session_id NOT IN (SELECT session_id FROM jobs WHERE session_id IS NOT NULL)')
+        conn.execute('DELETE FROM inflight_jobs WHERE created_at < ?', (time.time() - INFLIGHT_JOB_TIMEOUT,))
+
+        # A session directory is removed only once none of its downloads remain
+        session_ids = {row[1] for row in expired if row[1]}
+        empty_sessions = {
+            session_id for session_id in session_ids
+            if not conn.execute('SELECT 1 FROM downloads WHERE session_id = ? LIMIT 1', (session_id,)).fetchone()
+        }
+        # Idle sessions without downloads (both lookups are indexed)
+        idle_sessions = [row[0] for row in conn.execute(
+            'SELECT s.session_id FROM sessions s WHERE s.last_seen < ? '
+            'AND NOT EXISTS (SELECT 1 FROM downloads d WHERE d.session_id = s.session_id) '
+            'ORDER BY s.last_seen LIMIT ?',
+            (time.time() - SESSION_LIFETIME, CLEANUP_BATCH_SIZE)
+        )]
+        conn.executemany('DELETE FROM sessions WHERE session_id = ?', [(session_id,) for session_id in idle_sessions])
 
-    with db_lock:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.execute(
-                'SELECT session_id, file_path FROM downloads WHERE created_at < ?',
-                (expiration,)
-            )
-            sessions_to_delete = set()
-            for row in cursor.fetchall():
-                session_id, file_path = row
-                sessions_to_delete.add(session_id)
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                    except Exception:
-                        pass
-            for session_id in sessions_to_delete:
-                session_dir = os.path.join('downloads', session_id)
-                if os.path.exists(session_dir):
-                    import shutil
-                    try:
-                        shutil.rmtree(session_dir)
-                    except Exception:
-                        pass
-            conn.execute('DELETE FROM downloads WHERE created_at < ?', (expiration,))
-            conn.commit()
-
-    # Also check flask_session folder for expired sessions
-    import glob
-    session_dir = 'flask_session'
-    if os.path.exists(session_dir):
-        for session_file in glob.glob(os.path.join(session_dir, 'sess_*')):
-            try:
-                file_mtime = os.path.getmtime(session_file)
-                if (datetime.datetime.now() - datetime.datetime.fromtimestamp(file_mtime)).total_seconds() > SESSION_LIFETIME:
-
-                    session_id = None
-                    with open(session_file, 'rb') as f:
-                        import pickle
-                        data = pickle.load(f)
-                        session_id = data.get('session_id')
-                    os.remove(session_file)
-                    if session_id:
-                        session_dir = os.path.join('downloads', session_id)
-                        if os.path.exists(session_dir):
-                            import shutil
-                            shutil.rmtree(session_dir)
-            except Exception:
-                pass
+    removed_paths = 0
+    for _, _, file_path in expired:
+        if file_path:
+            removed_paths += _remove_path(file_path)
+    for session_id in empty_sessions.union(idle_sessions):
+        removed_paths += _remove_path(os.path.join('downloads', session_id))
+    removed_paths += _remove_path(LEGACY_SESSION_DIR)
+    return removed_paths
 
 def get_safe_thread_count():
     # Check environment variable for override
@@ -69,3 +134,44 @@ def get_safe_thread_count():
     # Default to 2 threads for shared hosting
     return 2
 
+def get_worker_process_count():
+    # Number of job worker processes started by worker.py
+    env_process_count = os.environ.get('WORKER_PROCESSES')
+    if env_process_count and env_process_count.isdigit():
+        return max(1, min(int(env_process_count), 8))
+    return 2
+
+def get_max_concurrent_jobs():
+    # Global limit on running jobs across all worker processes
+    env_job_count = os.environ.get('MAX_CONCURRENT_JOBS')
+    if env_job_count and env_job_count.isdigit():
+        return max(1, min(int(env_job_count), 32))
+    return 4
+
+def get_playlist_concurrency():
+    # Number of playlist entries downloaded in parallel within one job
+    env_entry_count = os.environ.get('PLAYLIST_CONCURRENCY')
+    if env_entry_count and env_entry_count.isdigit():
+        return max(1, min(int(env_entry_count), 16))
+    return 3
+
+def get_transcode_thread_count():
+    # CPU-bound transcode threads per worker process; defaults to the cores available to each process
+    env_transcode_count = os.environ.get('TRANSCODE_THREADS')
+    if env_transcode_count and env_transcode_count.isdigit():
+        return max(1, min(int(env_transcode_count), 64))
+    return max(1, (os.cpu_count() or 1) // get_worker_process_count())
+
+def get_profile_interval():
+    # Seconds between stack samples of the opt-in worker thread profiler (tracing.Profiler); 0 = off
+    env_interval = os.environ.get('PROFILE_INTERVAL_MS')
+    if env_interval and env_interval.isdigit():
+        return min(int(env_interval), 1000) / 1000
+    return 0
+
+def get_transcode_queue_size():
+    # Transcode steps that may wait for a thread before download threads block
+    env_queue_size = os.environ.get('TRANSCODE_QUEUE_SIZE')
+    if env_queue_size and env_queue_size.isdigit():
+        return max(1, min(int(env_queue_size), 256))
+    return 2 * get_transcode_thread_count()
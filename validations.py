@@ -1,10 +1,14 @@
 import re
 
-import yt_dlp
+from config import AUDIO_FORMATS, RESOLUTIONS, VIDEO_FORMATS
+from metadata_cache import get_video_info
 
 
 def is_valid_url(url):
-    """Validate if the URL is a proper YouTube URL, including Shorts."""
+    """
+    Validate if the URL is a proper YouTube URL, including Shorts.
+    Only checks the format; accessibility is checked by the worker (check_url_accessible).
+    """
     if not url or not isinstance(url, str):
         return False, "URL is required and must be a string"
     
@@ -15,17 +19,61 @@ def is_valid_url(url):
     )
     if not re.match(youtube_regex, url):
         return False, "Invalid YouTube URL format"
-    
-    # Check if URL is accessible
+    return True, None
+
+def check_url_accessible(url):
+    """Check that metadata can be retrieved for the URL (network access, run by the worker)."""
     try:
-        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if not info:
-                return False, "Could not retrieve video or playlist information"
+        info = get_video_info(url)
+        if not info:
+            return False, "Could not retrieve video or playlist information"
         return True, None
     except Exception as e:
         return False, f"Invalid URL: {str(e)}"
 
+DURATION_LIMITS = {'4k': 15 * 60, '2k': 30 * 60}  # in seconds
+
+def check_video_duration(url, resolution):
+    """
+    Check if a video's duration exceeds limits for 4K (15 min) or 2K (30 min).
+    Returns a tuple: (is_valid, error_message).
+    Playlist jobs check their entries as they are listed instead (check_entry_duration).
+    """
+    if resolution not in DURATION_LIMITS:
+        return True, None
+
+    try:
+        info = get_video_info(url)
+        duration = info.get('duration') or 0
+        if duration > DURATION_LIMITS[resolution]:
+            return False, f"Video exceeds {DURATION_LIMITS[resolution]//60}-minute limit for {resolution}"
+        return True, None
+    except Exception as e:
+        return False, f"Error checking duration: {str(e)}"
+
+def check_entry_duration(entry, resolution):
+    """Check one flat playlist entry against the 4K/2K duration limits. Returns (is_valid, error_message)."""
+    limit = DURATION_LIMITS.get(resolution)
+    if limit and (entry.get('duration') or 0) > limit:
+        return False, f"Video '{entry.get('title', 'Unknown')}' exceeds {limit//60}-minute limit for {resolution}"
+    return True, None
+
+def is_valid_audio_format(format_type, bitrate):
+    """Check the audio format and bitrate against config.AUDIO_FORMATS."""
+    if format_type not in AUDIO_FORMATS:
+        return False, f"Unsupported audio format: {format_type}"
+    if not bitrate or not bitrate.isdigit() or int(bitrate) not in AUDIO_FORMATS[format_type]:
+        return False, f"Unsupported bitrate for {format_type}: {bitrate}"
+    return True, None
+
+def is_valid_video_format(format_type, resolution):
+    """Check the video format and resolution against config."""
+    if format_type not in VIDEO_FORMATS:
+        return False, f"Unsupported video format: {format_type}"
+    if resolution not in RESOLUTIONS:
+        return False, f"Unsupported resolution: {resolution}"
+    return True, None
+
 def is_valid_time_format(time_str):
     """Validate if the time string is in HH:MM:SS or MM:SS format."""
     if not time_str:
@@ -47,6 +95,13 @@ def is_valid_time_format(time_str):
     except ValueError:
         return False, "Invalid time format"
 
+def time_to_seconds(time_str):
+    """Convert a validated HH:MM:SS or MM:SS string to seconds."""
+    parts = [int(part) for part in time_str.split(':')]
+    if len(parts) == 3:
+        return parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return parts[0] * 60 + parts[1]
+
 def is_playlist(url):
     """Check if the URL is a playlist."""
     return 'playlist' in url.lower() or 'list=' in url
@@ -0,0 +1,245 @@
+import inspect
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from config import JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, STORAGE_DEFER_SECONDS
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from downloader import JOB_HANDLERS, admit_job
+from init_db import init_db
+from db import write_buffer
+from jobs import (claim_job, defer_job, expire_leases, finish_job_lease, get_lease_holders, mark_transcoding,
+                  release_jobs, renew_leases, requeue_expired_jobs)
+from metrics import inc, observe, set_gauge
+from pipeline import TranscodePool
+from progress import update_status
+from tracing import Profiler, bind_job, tracer
+from utils import (cleanup_expired_sessions, get_max_concurrent_jobs, get_profile_interval, get_safe_thread_count, get_transcode_queue_size,
+                   get_transcode_thread_count, get_worker_process_count)
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(download_id, job_type, payload, transcode_pool, on_transcode, on_done):
+    """
+    Run a claimed job on the calling thread up to its CPU-bound steps, which continue on
+    transcode_pool. on_done(succeeded) is called when the job has finished either way.
+    """
+    handler = JOB_HANDLERS.get(job_type)
+    if handler is None:
+        update_status(download_id, f'Error: Unknown job type {job_type}')
+        on_done(False)
+        return
+    try:
+        job = handler(download_id, **payload)
+    except Exception:
+        # Handlers record the error status themselves
+        logger.exception('Job %s (%s) failed', download_id, job_type)
+        on_done(False)
+        return
+    if inspect.isgenerator(job):
+        transcode_pool.run_job(job, on_transcode, on_done)
+    else:
+        on_done(True)
+
+
+def worker_loop(worker_id, active_jobs, transcode_pool, stop_event):
+    """Claim jobs and run their download stage until stop_event is set."""
+    max_concurrency = get_max_concurrent_jobs()
+    while not stop_event.is_set():
+        try:
+            job = claim_job(worker_id, max_concurrency)
+        except Exception:
+            logger.exception('Failed to claim job')
+            job = None
+        if job is None:
+            stop_event.wait(JOB_POLL_INTERVAL)
+            continue
+
+        download_id, job_type, payload, queued_at = job
+        active_jobs.add(download_id)
+        started, started_at = time.monotonic(), time.time()
+        tracer.record(download_id, 'queue', queued_at, started_at - queued_at)
+
+        with bind_job(download_id):
+            try:
+                decision = admit_job(download_id, payload)
+            except Exception:
+                logger.exception('Disk budget check failed for job %s', download_id)
+                decision = 'ok'
+            if decision != 'ok':
+                try:
+                    if decision == 'defer':
+                        defer_job(download_id, worker_id, STORAGE_DEFER_SECONDS)
+                    else:
+                        finish_job_lease(download_id, worker_id, 'failed')
+                finally:
+                    active_jobs.discard(download_id)
+                continue
+
+            def on_transcode(download_id=download_id):
+                mark_transcoding(download_id, worker_id)
+
+            def on_done(succeeded, download_id=download_id, job_type=job_type, started=started, started_at=started_at):
+                duration = time.monotonic() - started
+                inc('ytdl_jobs_finished_total', job_type=job_type, result='done' if succeeded else 'failed')
+                observe('ytdl_job_duration_seconds', duration, job_type=job_type)
+                tracer.record(download_id, 'job', started_at, duration)
+                try:
+                    finish_job_lease(download_id, worker_id, 'done' if succeeded else 'failed')
+                finally:
+                    active_jobs.discard(download_id)
+                try:
+                    tracer.flush()
+                except Exception:
+                    logger.exception('Failed to write job spans')
+
+            run_job(download_id, job_type, payload, transcode_pool, on_transcode, on_done)
+
+
+def heartbeat_loop(worker_id, active_jobs, transcode_pool, stop_event):
+    """Keep the leases of running jobs alive while this process is healthy."""
+    while not stop_event.wait(JOB_LEASE_SECONDS / 3):
+        set_gauge('ytdl_transcode_queue_depth', transcode_pool.tasks.qsize())
+        set_gauge('ytdl_worker_active_jobs', len(active_jobs))
+        try:
+            renew_leases(worker_id, list(active_jobs))
+        except Exception:
+            logger.exception('Failed to renew job leases')
+        try:
+            tracer.flush()
+        except Exception:
+            logger.exception('Failed to write job spans')
+
+
+def start_worker_threads(num_threads, stop_event=None):
+    """
+    Start num_threads download threads, a transcode pool (TRANSCODE_THREADS) and a lease
+    heartbeat in the current process. Returns the threads and a shutdown function that stops
+    claiming jobs and hands the jobs in progress back to the queue.
+    """
+    worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    stop_event = stop_event or threading.Event()
+    active_jobs = set()
+    transcode_pool = TranscodePool(get_transcode_thread_count(), get_transcode_queue_size())
+    threads = [threading.Thread(target=heartbeat_loop, args=(worker_id, active_jobs, transcode_pool, stop_event), daemon=True)]
+    threads += [
+        threading.Thread(target=worker_loop, args=(worker_id, active_jobs, transcode_pool, stop_event), daemon=True)
+        for _ in range(num_threads)
+    ]
+    for thread in threads:
+        thread.start()
+
+    def shutdown():
+        stop_event.set()
+        # Checkpoints and progress still in the buffer go out before the jobs are released
+        write_buffer.flush()
+        tracer.flush()
+        release_jobs(worker_id, list(active_jobs))
+
+    return threads, shutdown
+
+
+def run_worker_process():
+    """Entry point of a single worker process."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+    threads, shutdown = start_worker_threads(get_safe_thread_count())
+    if get_profile_interval():
+        Profiler(get_profile_interval()).start()
+
+    def on_sigterm(signum, frame):
+        # Jobs are resumed elsewhere from their checkpoints; the download threads are
+        # daemons and die with the process, leaving their .part files to continue from
+        try:
+            shutdown()
+        finally:
+            os._exit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    for thread in threads:
+        thread.join()
+
+
+def _is_dead_local_worker(worker_id):
+    hostname, pid, _ = worker_id.rsplit('-', 2)
+    if hostname != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        pass
+    return False
+
+
+def requeue_orphaned_jobs():
+    """
+    Requeue the jobs of worker processes on this host that no longer exist (crashed or killed),
+    instead of waiting for their leases to expire. They resume from their checkpoints, and the
+    interrupted attempt counts towards JOB_MAX_ATTEMPTS.
+    """
+    dead = [worker_id for worker_id in get_lease_holders() if _is_dead_local_worker(worker_id)]
+    if dead:
+        expire_leases(dead)
+    count = requeue_expired_jobs()
+    if count:
+        logger.info('Requeued %d interrupted jobs', count)
+
+
+def start_session_sweeper():
+    """
+    Run cleanup_expired_sessions every 10 seconds. It runs in the worker.py main process only,
+    not in the web workers: one scheduler per host instead of one per Gunicorn worker.
+    """
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(func=cleanup_expired_sessions, trigger="interval", seconds=10)
+    scheduler.start()
+    return scheduler
+
+
+def main():
+    init_db()
+    requeue_orphaned_jobs()
+    # Worker processes are forked by a forkserver, a fresh process that imports this module once.
+    # So they inherit neither the SQLite connections nor the threads (session sweeper, metrics
+    # flush) of this process, which keeps running them while it replaces processes that die.
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['worker'])
+    processes = []
+    for _ in range(get_worker_process_count()):
+        process = context.Process(target=run_worker_process)
+        process.start()
+        processes.append(process)
+    start_session_sweeper()
+
+    def on_sigterm(signum, frame):
+        # Each worker process releases its jobs on SIGTERM (see run_worker_process)
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(JOB_LEASE_SECONDS)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    # Replace worker processes that die so the pool stays at full size
+    while True:
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logger.warning('Worker process %s exited with %s, restarting', process.pid, process.exitcode)
+                requeue_orphaned_jobs()
+                processes[i] = context.Process(target=run_worker_process)
+                processes[i].start()
+        time.sleep(5)
+
+
+if __name__ == '__main__':
+    main()
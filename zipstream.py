@@ -0,0 +1,157 @@
+import json
+import os
+import struct
+import time
+import zlib
+
+MANIFEST_NAME = '.zip_manifest.json'
+CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_MARKER = 0xFFFFFFFF  # header value meaning "see the zip64 extra field"
+
+
+def _crc32(file_path):
+    crc = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def write_zip_manifest(directory, file_paths):
+    """
+    Record size, CRC32 and mtime of the files to archive so the zip can be streamed later
+    without reading them twice. Paths are stored relative to directory.
+    """
+    entries = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        entries.append({
+            'name': os.path.relpath(file_path, directory),
+            'size': stat.st_size,
+            'crc': _crc32(file_path),
+            'mtime': stat.st_mtime,
+        })
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as f:
+        json.dump(entries, f)
+
+
+def has_zip_manifest(directory):
+    return os.path.isfile(os.path.join(directory, MANIFEST_NAME))
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, dos_date
+
+
+class ZipStream:
+    """
+    An uncompressed (ZIP_STORED) archive of a directory, generated on the fly from its manifest.
+    The byte layout is fully determined up front, so the total size is known before streaming.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filename = os.path.basename(os.path.normpath(directory)) + '.zip'
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            self.entries = json.load(f)
+        # Each segment is either bytes (headers) or (path, size) file data
+        self.segments = []
+        self.size = 0
+        self._build()
+
+    def _add(self, segment):
+        self.segments.append(segment)
+        self.size += len(segment) if isinstance(segment, bytes) else segment[1]
+
+    def _build(self):
+        prefix = os.path.basename(os.path.normpath(self.directory))
+        central_directory = []
+        for entry in self.entries:
+            name = os.path.join(prefix, entry['name']).replace(os.sep, '/').encode('utf-8')
+            size, crc = entry['size'], entry['crc']
+            dos_time, dos_date = _dos_datetime(entry['mtime'])
+            offset = self.size
+            needs_zip64 = size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+            version = 45 if needs_zip64 else 20
+            flags = 0x0800  # UTF-8 file names
+
+            local_extra = b''
+            local_size = size
+            if size >= ZIP64_LIMIT:
+                local_extra = struct.pack('<HHQQ', 0x0001, 16, size, size)
+                local_size = ZIP64_MARKER
+            self._add(struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, version, flags, 0, dos_time, dos_date,
+                crc, local_size, local_size, len(name), len(local_extra)
+            ) + name + local_extra)
+            self._add((os.path.join(self.directory, entry['name']), size))
+
+            zip64_fields = []
+            central_size = size
+            central_offset = offset
+            if size >= ZIP64_LIMIT:
+                zip64_fields += [size, size]
+                central_size = ZIP64_MARKER
+            if offset >= ZIP64_LIMIT:
+                zip64_fields.append(offset)
+                central_offset = ZIP64_MARKER
+            central_extra = b''
+            if zip64_fields:
+                central_extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields), *zip64_fields)
+            central_directory.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, flags, 0,
+                dos_time, dos_date, crc, central_size, central_size, len(name), len(central_extra),
+                0, 0, 0, 0o100644 << 16, central_offset
+            ) + name + central_extra)
+
+        cd_offset = self.size
+        cd_bytes = b''.join(central_directory)
+        cd_size = len(cd_bytes)
+        count = len(central_directory)
+        end_records = b''
+        if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            zip64_end_offset = cd_offset + cd_size
+            end_records += struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset
+            )
+            end_records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+            count = min(count, 0xFFFF)
+            cd_size = min(cd_size, ZIP64_MARKER)
+            cd_offset = ZIP64_MARKER
+        end_records += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+        self._add(cd_bytes + end_records)
+
+    def iter_chunks(self, start=0, end=None):
+        """Yield the archive bytes in [start, end), reading member files in CHUNK_SIZE pieces."""
+        end = self.size if end is None else min(end, self.size)
+        position = 0
+        for segment in self.segments:
+            length = len(segment) if isinstance(segment, bytes) else segment[1]
+            seg_start, seg_end = max(start, position), min(end, position + length)
+            if seg_start < seg_end:
+                if isinstance(segment, bytes):
+                    yield segment[seg_start - position:seg_end - position]
+                else:
+                    with open(segment[0], 'rb') as f:
+                        f.seek(seg_start - position)
+                        remaining = seg_end - seg_start
+                        while remaining > 0:
+                            chunk = f.read(min(CHUNK_SIZE, remaining))
+                            if not chunk:
+                                raise IOError(f"{segment[0]} is shorter than recorded in the manifest")
+                            remaining -= len(chunk)
+                            yield chunk
+            position += length
+            if position >= end:
+                break
+
+    def write_to(self, zip_path):
+        """Materialize the archive on disk."""
+        with open(zip_path, 'wb') as f:
+            for chunk in self.iter_chunks():
+                f.write(chunk)